@@ -1,5 +1,6 @@
 from six.moves import zip
 
+import tensorflow as tf
 from keras.optimizers import Optimizer
 from keras import backend as K
 from keras.legacy import interfaces
@@ -15,6 +16,10 @@ class AdamW(Optimizer):
         epsilon: float >= 0. Fuzz factor.
         decay: float >= 0. Learning rate decay over each update.
         weight_decay: float >= 0. Decoupled weight decay over each update.
+        loss_scale: float > 0. Initial dynamic loss scale for mixed precision training, None disables loss scaling.
+            The gradients of the scaled loss are divided by the scale, a step with non finite gradients is skipped
+            and halves the scale, which doubles after `loss_scale_period` steps without overflow.
+        loss_scale_period: int > 0. Steps without overflow before the loss scale doubles.
     # References
         - [Adam - A Method for Stochastic Optimization](http://arxiv.org/abs/1412.6980v8)
         - [Optimization for Deep Learning Highlights in 2017](http://ruder.io/deep-learning-optimization-2017/index.html)
@@ -22,7 +27,9 @@ class AdamW(Optimizer):
     """
 
     def __init__(self, lr=0.001, beta_1=0.9, beta_2=0.999, weight_decay=1e-4,  # decoupled weight decay (1/4)
-                 epsilon=1e-8, decay=0., **kwargs):
+                 epsilon=1e-8, decay=0., loss_scale=None, loss_scale_period=2000, **kwargs):
+        if loss_scale is not None and ('clipnorm' in kwargs or 'clipvalue' in kwargs):
+            raise ValueError('Gradient clipping is not supported with loss scaling')
         super(AdamW, self).__init__(**kwargs)
         with K.name_scope(self.__class__.__name__):
             self.iterations = K.variable(0, dtype='int64', name='iterations')
@@ -31,13 +38,25 @@ class AdamW(Optimizer):
             self.beta_2 = K.variable(beta_2, name='beta_2')
             self.decay = K.variable(decay, name='decay')
             self.wd = K.variable(weight_decay, name='weight_decay')  # decoupled weight decay (2/4)
+            if loss_scale is not None:
+                self.loss_scale = K.variable(loss_scale, name='loss_scale')
+                self.good_steps = K.variable(0, dtype='int64', name='good_steps')
         self.epsilon = epsilon
         self.initial_decay = decay
+        self.initial_loss_scale = loss_scale
+        self.loss_scale_period = loss_scale_period
 
     @interfaces.legacy_get_updates_support
     def get_updates(self, loss, params):
-        grads = self.get_gradients(loss, params)
-        self.updates = [K.update_add(self.iterations, 1)]
+        if self.initial_loss_scale is None:
+            grads = self.get_gradients(loss, params)
+            self.updates = [K.update_add(self.iterations, 1)]
+        else:
+            # small float16 gradients underflow, they are computed for the scaled loss and unscaled in float32
+            grads = [g / self.loss_scale for g in self.get_gradients(loss * self.loss_scale, params)]
+            finite = tf.reduce_all([tf.reduce_all(tf.is_finite(g)) for g in grads])
+            self.updates = [K.update_add(self.iterations, K.cast(finite, 'int64'))]
+            self.updates.extend(self.loss_scale_updates(finite))
         wd = self.wd  # decoupled weight decay (3/4)
 
         lr = self.lr
@@ -57,6 +76,11 @@ class AdamW(Optimizer):
             m_t = (self.beta_1 * m) + (1. - self.beta_1) * g
             v_t = (self.beta_2 * v) + (1. - self.beta_2) * K.square(g)
             p_t = p - lr_t * m_t / (K.sqrt(v_t) + self.epsilon) - lr * wd * p  # decoupled weight decay (4/4)
+            if self.initial_loss_scale is not None:
+                # a step with overflowed gradients leaves the weights and moments as they are
+                m_t = K.switch(finite, m_t, m)
+                v_t = K.switch(finite, v_t, v)
+                p_t = K.switch(finite, p_t, p)
 
             self.updates.append(K.update(m, m_t))
             self.updates.append(K.update(v, v_t))
@@ -69,12 +93,21 @@ class AdamW(Optimizer):
             self.updates.append(K.update(p, new_p))
         return self.updates
 
+    def loss_scale_updates(self, finite):
+        good_steps = K.switch(finite, self.good_steps + 1, K.zeros_like(self.good_steps))
+        grow = K.greater_equal(good_steps, self.loss_scale_period)
+        loss_scale = K.switch(finite, K.switch(grow, self.loss_scale * 2., self.loss_scale), self.loss_scale / 2.)
+        return [K.update(self.loss_scale, loss_scale),
+                K.update(self.good_steps, K.switch(grow, K.zeros_like(good_steps), good_steps))]
+
     def get_config(self):
         config = {'lr': float(K.get_value(self.lr)),
                   'beta_1': float(K.get_value(self.beta_1)),
                   'beta_2': float(K.get_value(self.beta_2)),
                   'decay': float(K.get_value(self.decay)),
                   'weight_decay': float(K.get_value(self.wd)),
-                  'epsilon': self.epsilon}
+                  'epsilon': self.epsilon,
+                  'loss_scale': self.initial_loss_scale,
+                  'loss_scale_period': self.loss_scale_period}
         base_config = super(AdamW, self).get_config()
         return dict(list(base_config.items()) + list(config.items()))
@@ -5,13 +5,57 @@ import numpy as np
 import cv2
 import tensorflow as tf
 
+import io
 import logging
+import argparse
 
-from predict import load_model, process_image
+from predict import load_model, process_images, process_image_tiled, batch_pixels, effective_tile_size, \
+    open_result_cache, new_stats
+from batching import RequestBatcher
+from inference_stats import InferenceMetrics, enable_logging
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--model_path', type=str, default='models/east/model-funsd150-icdar200.h5')
+parser.add_argument('--backend', type=str, default='keras', choices=['keras', 'tflite'])
+parser.add_argument('--host', type=str, default='127.0.0.1')
+parser.add_argument('--port', type=int, default=5001)
+# requests arriving within this many milliseconds of each other share a forward pass
+parser.add_argument('--batch_window', type=float, default=10)
+parser.add_argument('--max_batch_size', type=int, default=8)
+parser.add_argument('--max_batch_pixels', type=int, default=8 * 2400 * 2400)
+# images are processed at full resolution in overlapping tiles of this size when > 0, see predict.process_image_tiled
+parser.add_argument('--tile_size', type=int, default=0)
+parser.add_argument('--tile_overlap', type=int, default=256)
+# collects the stage durations and box counts of the requests and batches, served as json by /metrics
+parser.add_argument('--metrics', action='store_true')
+# logs the stats of every batch as json lines to this file, or stderr with '-'
+parser.add_argument('--stats_log', type=str, default='')
+# boxes of images already processed are read from this directory when set, see predict.py
+parser.add_argument('--cache_dir', type=str, default='')
+parser.add_argument('--cache_size', type=int, default=1024)
 
 app = Flask(__name__)
 
 
+def process_batch(images):
+    stats = new_stats(FLAGS, cache, metrics=FLAGS.metrics)
+    with graph.as_default():
+        if tile_size > 0:
+            results = [process_image_tiled(model, image, tile_size, FLAGS.tile_overlap,
+                                           batch_size=FLAGS.max_batch_size, stats=stats) for image in images]
+        else:
+            # a single image too, process_images pads it to its bucket so that its boxes do not depend on the
+            # requests it was batched with
+            results = process_images(model, images, batch_size=len(images), stats=stats)
+
+    stats.count('images', len(images))
+    if FLAGS.metrics:
+        batch_metrics.add(stats)
+    stats.log(images=len(images))
+    # the error tells process not to cache the boxes of a failed batch
+    return [(boxes, stats.error) for boxes in results]
+
+
 @app.route('/')
 def index():
     return 'Get request to EAST server.'
@@ -19,13 +63,29 @@ def index():
 
 @app.route('/process', methods=['POST'])
 def process():
-    image_buf = request.files['image']
-    image = Image.open(image_buf).convert('RGB')
-    image = cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR)
+    stats = new_stats(FLAGS, cache, metrics=FLAGS.metrics)
+    data = request.files['image'].read()
+    boxes = None
+    if cache is not None:
+        with stats.stage('cache'):
+            key = cache_key(data)
+            boxes = cache.get(key)
+        stats.count('cache_hits', boxes is not None)
 
-    global graph
-    with graph.as_default():
-        boxes = process_image(model, image)
+    if boxes is None:
+        with stats.stage('decode'):
+            image = Image.open(io.BytesIO(data)).convert('RGB')
+            image = cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR)
+
+        # waiting for the batch and running it
+        with stats.stage('batch'):
+            boxes, error = batcher.submit(image)
+        if cache is not None and error is None:
+            with stats.stage('cache'):
+                cache.put(key, boxes)
+    stats.count('boxes', len(boxes))
+    if FLAGS.metrics:
+        request_metrics.add(stats)
 
     lines = []
     for box in boxes:
@@ -35,8 +95,29 @@ def process():
     return jsonify(lines)
 
 
+@app.route('/metrics')
+def metrics():
+    if not FLAGS.metrics:
+        return 'Metrics are disabled, start the server with --metrics.', 404
+    metrics = {'requests': request_metrics.as_dict(), 'batches': batch_metrics.as_dict()}
+    if cache is not None:
+        metrics['cache'] = cache.stats()
+    return jsonify(metrics)
+
+
 if __name__ == '__main__':
+    FLAGS = parser.parse_args()
     logging.getLogger().setLevel(logging.ERROR)
-    model = load_model(model_path='models/east/model-funsd150-icdar200.h5')
+    if FLAGS.stats_log:
+        enable_logging(None if FLAGS.stats_log == '-' else FLAGS.stats_log)
+    request_metrics = InferenceMetrics()
+    batch_metrics = InferenceMetrics()
+    model = load_model(model_path=FLAGS.model_path, backend=FLAGS.backend)
+    tile_size = effective_tile_size(model, FLAGS)
+    cache, cache_key = open_result_cache(FLAGS, tile_size)
     graph = tf.get_default_graph()
-    app.run(host='127.0.0.1', port=5001)
+    # without tiles the images of a batch are resized and padded before the forward pass, see process_images
+    batcher = RequestBatcher(process_batch, batch_window=FLAGS.batch_window / 1000.,
+                             max_batch_size=FLAGS.max_batch_size, max_batch_pixels=FLAGS.max_batch_pixels,
+                             image_pixels=None if tile_size > 0 else batch_pixels)
+    app.run(host=FLAGS.host, port=FLAGS.port, threaded=True)
@@ -0,0 +1,83 @@
+import time
+import queue
+import threading
+
+
+class PendingRequest:
+
+    def __init__(self, image, pixels):
+        self.image = image
+        self.pixels = pixels
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class RequestBatcher:
+    # collects images submitted concurrently and runs them through process_batch together
+    # a batch is closed when batch_window seconds passed since its first request, when it holds max_batch_size
+    # images or when the next image would take it above max_batch_pixels, a single larger image still runs alone
+    # process_batch takes a list of images and returns a list with one result per image
+    # image_pixels gives the pixels an image counts for in max_batch_pixels, by default its own size, e.g. the size
+    # it is resized and padded to for the forward pass
+
+    def __init__(self, process_batch, batch_window=0.01, max_batch_size=8, max_batch_pixels=8 * 2400 * 2400,
+                 image_pixels=None):
+        self.process_batch = process_batch
+        self.image_pixels = image_pixels or (lambda image: image.shape[0] * image.shape[1])
+        self.batch_window = batch_window
+        self.max_batch_size = max_batch_size
+        self.max_batch_pixels = max_batch_pixels
+
+        self.requests = queue.Queue()
+        # request that did not fit in the previous batch, it starts the next one
+        self.next_request = None
+
+        self.worker = threading.Thread(target=self.run, daemon=True)
+        self.worker.start()
+
+    def submit(self, image):
+        # blocks until the batch holding image was processed and returns the result for image
+        request = PendingRequest(image, self.image_pixels(image))
+        self.requests.put(request)
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.result
+
+    def collect(self):
+        if self.next_request is not None:
+            first, self.next_request = self.next_request, None
+        else:
+            first = self.requests.get()
+
+        batch = [first]
+        pixels = first.pixels
+        deadline = time.monotonic() + self.batch_window
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                request = self.requests.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if pixels + request.pixels > self.max_batch_pixels:
+                self.next_request = request
+                break
+            batch.append(request)
+            pixels += request.pixels
+        return batch
+
+    def run(self):
+        while True:
+            batch = self.collect()
+            try:
+                results = self.process_batch([request.image for request in batch])
+                for request, result in zip(batch, results):
+                    request.result = result
+            except Exception as e:
+                for request in batch:
+                    request.error = e
+            for request in batch:
+                request.done.set()
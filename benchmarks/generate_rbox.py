@@ -0,0 +1,44 @@
+# throughput of data_processor.generate_rbox on the sample data
+# run from the repository root: python -m benchmarks.generate_rbox
+
+from argparse import Namespace
+
+import cv2
+
+from data_processor import get_image_paths, load_annotation, check_and_validate_polys, pad_image, resize_image, \
+    generate_rbox
+from benchmarks.timing import best_time
+
+DATA_PATH = 'data/sample_data/train_data'
+INPUT_SIZE = 512
+REPEATS = 10
+
+# defaults of train.py
+FLAGS = Namespace(min_text_size=10, min_crop_side_ratio=0.1, geometry='RBOX', suppress_warnings_and_error_messages=True)
+
+
+def load_samples():
+    # inputs of generate_rbox for every sample, prepared the way DataGenerator.load_validation does
+    samples = []
+    for image_path in sorted(get_image_paths(DATA_PATH)):
+        image = cv2.imread(image_path)
+        h, w, _ = image.shape
+        text_polys, text_tags = load_annotation(image_path)
+        text_polys, text_tags = check_and_validate_polys(FLAGS, text_polys, text_tags, (h, w))
+        image, shift_h, shift_w = pad_image(image, INPUT_SIZE, is_train=False)
+        image, text_polys = resize_image(image, text_polys, INPUT_SIZE, shift_h, shift_w)
+        samples.append((image.shape[:2], text_polys, text_tags))
+    return samples
+
+
+def main():
+    samples = load_samples()
+
+    def run():
+        for im_size, text_polys, text_tags in samples:
+            generate_rbox(FLAGS, im_size, text_polys, text_tags)
+    print('generate_rbox: {:.1f} samples/s'.format(len(samples) / best_time(run, REPEATS)))
+
+
+if __name__ == '__main__':
+    main()
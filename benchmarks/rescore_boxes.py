@@ -0,0 +1,57 @@
+# micro-benchmark for the box re-scoring step of predict.detect
+# run from the repository root: python -m benchmarks.rescore_boxes
+
+import cv2
+import numpy as np
+
+from data_processor import get_image_paths, load_annotation
+from predict import box_mean_scores
+from benchmarks.timing import best_time
+
+DATA_PATH = 'data/sample_data/train_data'
+# every annotation is repeated with small random offsets to emulate the hundreds of boxes of a dense form
+COPIES = 20
+REPEATS = 5
+
+
+def box_mean_scores_reference(score_map, boxes):
+    # the original implementation, a full size mask for every box
+    scores = np.zeros(boxes.shape[0], dtype=np.float32)
+    for i, box in enumerate(boxes):
+        mask = np.zeros_like(score_map, dtype=np.uint8)
+        cv2.fillPoly(mask, box[:8].reshape((-1, 4, 2)).astype(np.int32) // 4, 1)
+        scores[i] = cv2.mean(score_map, mask)[0]
+    return scores
+
+
+def make_sample(image_path, rng):
+    h, w, _ = cv2.imread(image_path).shape
+    text_polys, _ = load_annotation(image_path)
+
+    score_map = rng.rand(h // 4, w // 4).astype(np.float32) * 0.5
+    cv2.fillPoly(score_map, (text_polys // 4).astype(np.int32), 0.9)
+
+    polys = np.concatenate([text_polys + rng.randint(-8, 8, size=(1, 1, 2)) for _ in range(COPIES)])
+    boxes = np.zeros((polys.shape[0], 9), dtype=np.float32)
+    boxes[:, :8] = polys.reshape((-1, 8))
+    return score_map, boxes
+
+
+def main():
+    rng = np.random.RandomState(0)
+    for image_path in sorted(get_image_paths(DATA_PATH)):
+        score_map, boxes = make_sample(image_path, rng)
+
+        expected = box_mean_scores_reference(score_map, boxes)
+        actual = box_mean_scores(score_map, boxes)
+        assert np.array_equal(expected, actual), 'scores differ from the reference implementation'
+
+        t_ref = best_time(lambda: box_mean_scores_reference(score_map, boxes), REPEATS)
+        t_new = best_time(lambda: box_mean_scores(score_map, boxes), REPEATS)
+        print('{}: {} boxes on a {}x{} score map, reference {:.2f} ms, roi {:.2f} ms, speedup {:.1f}x'.format(
+            image_path, boxes.shape[0], score_map.shape[1], score_map.shape[0], t_ref * 1e3, t_new * 1e3,
+            t_ref / t_new))
+
+
+if __name__ == '__main__':
+    main()
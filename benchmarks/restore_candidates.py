@@ -0,0 +1,58 @@
+# micro-benchmark for the candidate restoring step of predict.detect
+# run from the repository root: python -m benchmarks.restore_candidates
+
+import numpy as np
+
+from data_processor import restore_rectangle
+from predict import restore_candidates
+from benchmarks.timing import best_time
+
+CANDIDATES = [10000, 100000, 1000000]
+# share of the score map pixels above the threshold
+TEXT_RATIO = 0.3
+SCORE_MAP_THRESH = 0.8
+REPEATS = 5
+
+
+def restore_candidates_reference(score_map, geo_map, score_map_thresh):
+    # the original implementation, argwhere, sort via the y axis and restore_rectangle per angle sign
+    # the sort is stable here so that the order of the boxes on a row is defined
+    xy_text = np.argwhere(score_map > score_map_thresh)
+    xy_text = xy_text[np.argsort(xy_text[:, 0], kind='stable')]
+    text_box_restored = restore_rectangle(xy_text[:, ::-1] * 4, geo_map[xy_text[:, 0], xy_text[:, 1], :])
+    boxes = np.zeros((text_box_restored.shape[0], 9), dtype=np.float32)
+    boxes[:, :8] = text_box_restored.reshape((-1, 8))
+    boxes[:, 8] = score_map[xy_text[:, 0], xy_text[:, 1]]
+    return boxes
+
+
+def make_maps(nb_candidates, rng):
+    # square maps with about nb_candidates pixels above the threshold, angles of both signs
+    side = int(np.ceil(np.sqrt(nb_candidates / TEXT_RATIO)))
+    score_map = np.where(rng.rand(side, side) < TEXT_RATIO, 0.9, 0.1).astype(np.float32)
+    geo_map = np.empty((side, side, 5), dtype=np.float32)
+    geo_map[:, :, :4] = rng.rand(side, side, 4) * 50
+    geo_map[:, :, 4] = (rng.rand(side, side) - 0.5) * np.pi / 2
+    return score_map, geo_map
+
+
+def main():
+    rng = np.random.RandomState(0)
+    for nb_candidates in CANDIDATES:
+        score_map, geo_map = make_maps(nb_candidates, rng)
+
+        # the reference groups the boxes by angle sign, the boxes themselves are the same
+        expected = restore_candidates_reference(score_map, geo_map, SCORE_MAP_THRESH)
+        actual = restore_candidates(score_map, geo_map, SCORE_MAP_THRESH)
+        negative = geo_map[score_map > SCORE_MAP_THRESH][:, 4] < 0
+        assert np.array_equal(expected, np.concatenate([actual[~negative], actual[negative]])), \
+            'boxes differ from the reference implementation'
+
+        t_ref = best_time(lambda: restore_candidates_reference(score_map, geo_map, SCORE_MAP_THRESH), REPEATS)
+        t_new = best_time(lambda: restore_candidates(score_map, geo_map, SCORE_MAP_THRESH), REPEATS)
+        print('{} candidates on a {}x{} score map, reference {:.2f} ms, fused {:.2f} ms, speedup {:.1f}x'.format(
+            actual.shape[0], score_map.shape[1], score_map.shape[0], t_ref * 1e3, t_new * 1e3, t_ref / t_new))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+# load test for the /process endpoint of a running app.py server
+# run from the repository root: python -m benchmarks.server_load --url=http://127.0.0.1:5001/process
+
+import time
+import uuid
+import argparse
+import threading
+import urllib.request
+
+import numpy as np
+
+from data_processor import get_image_paths
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--url', type=str, default='http://127.0.0.1:5001/process')
+parser.add_argument('--data_path', type=str, default='data/sample_data/train_data')
+parser.add_argument('--concurrency', type=str, default='1,2,4,8,16')
+parser.add_argument('--requests', type=int, default=64)
+
+
+def multipart_body(image_path):
+    boundary = uuid.uuid4().hex
+    with open(image_path, 'rb') as f:
+        image = f.read()
+    body = b''.join([
+        '--{}\r\n'.format(boundary).encode(),
+        'Content-Disposition: form-data; name="image"; filename="{}"\r\n'.format(image_path).encode(),
+        b'Content-Type: application/octet-stream\r\n\r\n',
+        image,
+        '\r\n--{}--\r\n'.format(boundary).encode(),
+    ])
+    return body, 'multipart/form-data; boundary={}'.format(boundary)
+
+
+def run_level(url, bodies, concurrency, nb_requests):
+    # nb_requests requests sent by concurrency threads, returns the latencies and the wall time
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+    counter = iter(range(nb_requests))
+
+    def client():
+        while True:
+            with lock:
+                i = next(counter, None)
+            if i is None:
+                return
+            body, content_type = bodies[i % len(bodies)]
+            req = urllib.request.Request(url, data=body, headers={'Content-Type': content_type})
+            start = time.perf_counter()
+            try:
+                urllib.request.urlopen(req).read()
+            except Exception as e:
+                with lock:
+                    errors.append(e)
+                continue
+            with lock:
+                latencies.append(time.perf_counter() - start)
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return np.array(latencies), len(errors), time.perf_counter() - start
+
+
+def main():
+    FLAGS = parser.parse_args()
+    bodies = [multipart_body(image_path) for image_path in sorted(get_image_paths(FLAGS.data_path))]
+
+    print('{:>12} {:>10} {:>10} {:>10} {:>8}'.format('concurrency', 'p50 (ms)', 'p99 (ms)', 'req/s', 'errors'))
+    for concurrency in map(int, FLAGS.concurrency.split(',')):
+        latencies, nb_errors, elapsed = run_level(FLAGS.url, bodies, concurrency, FLAGS.requests)
+        if len(latencies) == 0:
+            print('{:>12} {:>10} {:>10} {:>10} {:>8}'.format(concurrency, '-', '-', '-', nb_errors))
+            continue
+        print('{:>12} {:>10.1f} {:>10.1f} {:>10.1f} {:>8}'.format(
+            concurrency, np.percentile(latencies, 50) * 1e3, np.percentile(latencies, 99) * 1e3,
+            len(latencies) / elapsed, nb_errors))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,242 @@
+# throughput of the detection and training input pipelines, on CPU and without pretrained weights
+# run from the repository root:
+#   python -m benchmarks.suite --output=results.json
+#   python -m benchmarks.suite --compare base.json results.json --tolerance=0.1
+# every result is a throughput, higher is better, --compare fails when one dropped by more than the tolerance
+
+import sys
+import json
+import time
+import platform
+import argparse
+
+import cv2
+import numpy as np
+
+from benchmarks.timing import best_time
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--output', type=str, default='')
+parser.add_argument('--only', type=str, default='', help='comma separated names of the benchmarks to run')
+parser.add_argument('--repeats', type=int, default=5)
+parser.add_argument('--compare', type=str, nargs=2, metavar=('BASE', 'NEW'))
+parser.add_argument('--tolerance', type=float, default=0.1)
+
+# the benchmarks import what they measure, so that --compare does not need tensorflow
+DATA_PATH = 'data/sample_data/train_data'
+INPUT_SIZE = 512
+BATCH_SIZE = 4
+# side of the score maps of the nms benchmark and share of their pixels covered by text
+NMS_MAP_SIDE = 256
+NMS_DENSITIES = [0.05, 0.2]
+CANDIDATES = [10000, 100000]
+TRAIN_INPUT_SIZE = 256
+
+
+def make_text_maps(side, density, rng):
+    # score and geo maps of horizontal text lines covering about density of the map, every pixel of a line has the
+    # geometry of its line like a well trained model would predict, the nms then merges them into one box per line
+    score_map = np.full((side, side), 0.1, dtype=np.float32)
+    geo_map = np.zeros((side, side, 5), dtype=np.float32)
+    covered = 0
+    while covered < density * side * side:
+        h, w = rng.randint(4, 12), rng.randint(16, side // 3)
+        y, x = rng.randint(0, side - h), rng.randint(0, side - w)
+        ys, xs = np.mgrid[y:y + h, x:x + w]
+        covered += np.count_nonzero(score_map[ys, xs] < 0.5)
+        score_map[ys, xs] = 0.9
+        # distances in input pixels to the top, right, bottom and left of the line, with some noise
+        noise = rng.rand(h, w, 4) * 2
+        geo_map[ys, xs, 0] = (ys - y) * 4 + noise[:, :, 0]
+        geo_map[ys, xs, 1] = (x + w - xs) * 4 + noise[:, :, 1]
+        geo_map[ys, xs, 2] = (y + h - ys) * 4 + noise[:, :, 2]
+        geo_map[ys, xs, 3] = (xs - x) * 4 + noise[:, :, 3]
+        geo_map[ys, xs, 4] = (rng.rand(h, w) - 0.5) * 0.02
+    return score_map, geo_map
+
+
+def bench_generate_rbox(repeats):
+    from data_processor import generate_rbox
+    from benchmarks.generate_rbox import FLAGS, load_samples
+
+    samples = load_samples()
+
+    def run():
+        for im_size, text_polys, text_tags in samples:
+            generate_rbox(FLAGS, im_size, text_polys, text_tags)
+    return {'samples_per_s': len(samples) / best_time(run, repeats)}
+
+
+def bench_data_generator(repeats):
+    from data_generator import DataGenerator
+    from benchmarks.generate_rbox import FLAGS
+
+    results = {}
+    for is_train in [True, False]:
+        generator = DataGenerator(INPUT_SIZE, BATCH_SIZE, DATA_PATH, FLAGS, is_train=is_train)
+        np.random.seed(0)
+        nb_batches = len(generator)
+
+        def run():
+            for index in range(nb_batches):
+                generator[index]
+        results['{}_batches_per_s'.format('training' if is_train else 'validation')] = \
+            nb_batches / best_time(run, repeats)
+    return results
+
+
+def bench_restore_rectangle(repeats):
+    from data_processor import restore_rectangle_rbox
+    from predict import restore_candidates
+    from benchmarks.restore_candidates import SCORE_MAP_THRESH, make_maps
+
+    rng = np.random.RandomState(0)
+    results = {}
+    for nb_candidates in CANDIDATES:
+        score_map, geo_map = make_maps(nb_candidates, rng)
+        xy_text = np.argwhere(score_map > SCORE_MAP_THRESH)
+        origin, geometry = xy_text[:, ::-1] * 4, geo_map[xy_text[:, 0], xy_text[:, 1], :]
+
+        results['restore_rectangle_rbox_{}_candidates_per_s'.format(nb_candidates)] = \
+            len(xy_text) / best_time(lambda: restore_rectangle_rbox(origin, geometry), repeats)
+        results['restore_candidates_{}_candidates_per_s'.format(nb_candidates)] = \
+            len(xy_text) / best_time(lambda: restore_candidates(score_map, geo_map, SCORE_MAP_THRESH), repeats)
+    return results
+
+
+def bench_nms(repeats):
+    import lanms
+    from predict import restore_candidates
+    from benchmarks.restore_candidates import SCORE_MAP_THRESH
+
+    rng = np.random.RandomState(0)
+    results = {}
+    for density in NMS_DENSITIES:
+        score_map, geo_map = make_text_maps(NMS_MAP_SIDE, density, rng)
+        candidates = restore_candidates(score_map, geo_map, SCORE_MAP_THRESH)
+        results['merge_quadrangle_n9_density_{}_candidates_per_s'.format(density)] = \
+            len(candidates) / best_time(lambda: lanms.merge_quadrangle_n9(candidates, 0.2), repeats)
+    return results
+
+
+def bench_rescore(repeats):
+    from data_processor import get_image_paths
+    from predict import box_mean_scores
+    from benchmarks.rescore_boxes import make_sample
+
+    rng = np.random.RandomState(0)
+    samples = [make_sample(image_path, rng) for image_path in sorted(get_image_paths(DATA_PATH))]
+    nb_boxes = sum(boxes.shape[0] for _, boxes in samples)
+
+    def run():
+        for score_map, boxes in samples:
+            box_mean_scores(score_map, boxes)
+    return {'boxes_per_s': nb_boxes / best_time(run, repeats)}
+
+
+def bench_process_image(repeats):
+    from keras.models import Model
+
+    from model import EastModel
+    from data_processor import get_image_paths
+    from predict import process_image
+    from inference_stats import InferenceStats
+
+    # the maps of a random model are meaningless, this measures the cost of the network and of the post-processing
+    east = EastModel(INPUT_SIZE, backbone_weights=None)
+    model = Model(inputs=east.input_image, outputs=[east.pred_score_map, east.pred_geo_map])
+    images = [cv2.imread(image_path) for image_path in sorted(get_image_paths(DATA_PATH))]
+    # builds the graph for the first image size
+    process_image(model, images[0])
+
+    stats = InferenceStats()
+
+    def run():
+        for image in images:
+            process_image(model, image, stats=stats)
+    results = {'images_per_s': len(images) / best_time(run, repeats)}
+    # where the time goes, not compared
+    results['details'] = {name: duration / (len(images) * repeats) for name, duration in stats.durations.items()}
+    return results
+
+
+def bench_train_step(repeats):
+    from benchmarks.train_step import mode_step_times
+
+    # every mode runs in its own process, xla flags only apply to a process that did not run tensorflow yet
+    results = {}
+    for mode in ['plain', 'xla']:
+        times = mode_step_times(mode, DATA_PATH, TRAIN_INPUT_SIZE, BATCH_SIZE, repeats)
+        results['{}_steps_per_s'.format(mode)] = 1 / min(times)
+    return results
+
+
+BENCHMARKS = [
+    ('generate_rbox', bench_generate_rbox),
+    ('data_generator', bench_data_generator),
+    ('restore_rectangle', bench_restore_rectangle),
+    ('nms', bench_nms),
+    ('rescore', bench_rescore),
+    ('process_image', bench_process_image),
+    ('train_step', bench_train_step),
+]
+
+
+def run(names, repeats):
+    results = {}
+    for name, benchmark in BENCHMARKS:
+        if names and name not in names:
+            continue
+        print('{}...'.format(name))
+        results[name] = benchmark(repeats)
+        for metric, value in results[name].items():
+            if metric != 'details':
+                print('  {}: {:.1f}'.format(metric, value))
+    return {
+        'meta': {'time': time.strftime('%Y-%m-%d %H:%M:%S'), 'python': platform.python_version(),
+                 'numpy': np.__version__, 'opencv': cv2.__version__, 'machine': platform.machine(),
+                 'processor': platform.processor(), 'repeats': repeats},
+        'results': results,
+    }
+
+
+def compare(base, new, tolerance):
+    # prints the change of every throughput found in both runs, returns the regressions
+    regressions = []
+    for name, metrics in base['results'].items():
+        for metric, base_value in metrics.items():
+            if metric == 'details' or metric not in new['results'].get(name, {}):
+                continue
+            new_value = new['results'][name][metric]
+            change = new_value / base_value - 1
+            regression = change < -tolerance
+            if regression:
+                regressions.append('{}.{}'.format(name, metric))
+            print('{:<60} {:>12.1f} {:>12.1f} {:>+8.1%}{}'.format('{}.{}'.format(name, metric), base_value, new_value,
+                                                                   change, '  REGRESSION' if regression else ''))
+    return regressions
+
+
+def main():
+    args = parser.parse_args()
+
+    if args.compare:
+        with open(args.compare[0]) as f:
+            base = json.load(f)
+        with open(args.compare[1]) as f:
+            new = json.load(f)
+        regressions = compare(base, new, args.tolerance)
+        if regressions:
+            print('{} regressions above {:.0%}: {}'.format(len(regressions), args.tolerance, ', '.join(regressions)))
+            sys.exit(1)
+        return
+
+    report = run([name for name in args.only.split(',') if name], args.repeats)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print('Wrote {}'.format(args.output))
+
+
+if __name__ == '__main__':
+    main()
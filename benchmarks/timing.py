@@ -0,0 +1,11 @@
+import time
+
+
+def best_time(fn, repeats):
+    # seconds of the fastest of repeats runs of fn, the least disturbed by the rest of the machine
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return min(times)
@@ -0,0 +1,94 @@
+# step time of the training step of train.py in the plain and the fast training modes, on CPU
+# run from the repository root: python -m benchmarks.train_step
+# the backbone is randomly initialized and the same batch of the sample data is used for every step
+# the float16 graph rewrite of --mixed_precision only happens on GPUs, on CPU that mode measures the cost of the loss
+# scaling on top of xla
+# tensorflow reads TF_XLA_FLAGS once per process, every mode runs in its own process with the flags set beforehand
+
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+
+import numpy as np
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--data_path', type=str, default='data/sample_data/train_data')
+parser.add_argument('--input_size', type=int, default=256)
+parser.add_argument('--batch_size', type=int, default=4)
+parser.add_argument('--steps', type=int, default=10)
+parser.add_argument('--modes', type=str, default='plain,xla,xla+mixed_precision')
+# internal, runs a single mode and prints its step times as json
+parser.add_argument('--single_mode', type=str, default='')
+
+LOSS_SCALE = 2. ** 15
+XLA_CPU_FLAG = '--tf_xla_cpu_global_jit'
+
+
+def load_batch(data_path, input_size, batch_size):
+    from data_generator import DataGenerator
+    from benchmarks.generate_rbox import FLAGS
+
+    np.random.seed(0)
+    return DataGenerator(input_size, batch_size, data_path, FLAGS, is_train=True)[0]
+
+
+def step_times(batch, input_size, xla=False, mixed_precision=False, steps=10):
+    # seconds of every training step after the first one, which builds and compiles the graph
+    # only valid in a process that did not run tensorflow before, see mode_step_times
+    import keras.backend as K
+    from model import EastModel, set_training_session
+    from train import compile_model
+
+    K.clear_session()
+    set_training_session(xla=xla, mixed_precision=mixed_precision)
+    east = EastModel(input_size, backbone_weights=None)
+    compile_model(east, 1e-4, loss_scale=LOSS_SCALE if mixed_precision else None)
+
+    inputs, targets = batch
+    east.model.train_on_batch(inputs, targets)
+    times = []
+    for _ in range(steps):
+        start = time.perf_counter()
+        east.model.train_on_batch(inputs, targets)
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def mode_step_times(mode, data_path, input_size, batch_size, steps):
+    # step_times of a mode such as 'xla+mixed_precision' in a new python process
+    env = dict(os.environ)
+    if 'xla' in mode and XLA_CPU_FLAG not in env.get('TF_XLA_FLAGS', ''):
+        env['TF_XLA_FLAGS'] = (env.get('TF_XLA_FLAGS', '') + ' ' + XLA_CPU_FLAG).strip()
+    output = subprocess.run([sys.executable, '-m', 'benchmarks.train_step', '--single_mode', mode,
+                             '--data_path', data_path, '--input_size', str(input_size),
+                             '--batch_size', str(batch_size), '--steps', str(steps)],
+                            env=env, stdout=subprocess.PIPE, check=True, universal_newlines=True).stdout
+    # tensorflow may print to stdout too, the times are on the last line
+    return json.loads(output.strip().split('\n')[-1])
+
+
+def main():
+    args = parser.parse_args()
+
+    if args.single_mode:
+        times = step_times(load_batch(args.data_path, args.input_size, args.batch_size), args.input_size,
+                           xla='xla' in args.single_mode, mixed_precision='mixed_precision' in args.single_mode,
+                           steps=args.steps)
+        print(json.dumps(times))
+        return
+
+    baseline = None
+    for mode in args.modes.split(','):
+        times = mode_step_times(mode, args.data_path, args.input_size, args.batch_size, args.steps)
+        median = np.median(times)
+        baseline = baseline or median
+        print('{:<24} median {:.1f} ms, min {:.1f} ms per step of {} {}x{} images, speedup {:.2f}x'.format(
+            mode, median * 1e3, min(times) * 1e3, args.batch_size, args.input_size, args.input_size,
+            baseline / median))
+
+
+if __name__ == '__main__':
+    main()
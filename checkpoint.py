@@ -0,0 +1,68 @@
+import os
+import hashlib
+import threading
+
+from data_processor import iter_image_paths
+
+
+def path_key(relative_path):
+    # 64 bit key of the path of an image relative to the data directory, stable across processes and runs
+    return int.from_bytes(hashlib.md5(relative_path.encode('utf-8')).digest()[:8], 'little')
+
+
+def in_shard(relative_path, shard, nb_shards):
+    # every image belongs to exactly one of nb_shards shards, independently of the listing order
+    return path_key(relative_path) % nb_shards == shard
+
+
+class Checkpoint:
+    # append only file of the relative paths of the images whose results are written, a run restarted with the same
+    # file skips them, only the keys of the paths are kept in memory
+    # concurrent processes, e.g. the shards of a run, need one file each
+
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.keys = set()
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    line = line.rstrip('\n')
+                    if line:
+                        self.keys.add(path_key(line))
+        self.file = open(path, 'a', encoding='utf-8')
+        # a run killed while writing a line leaves it unfinished, the next line must not be appended to it
+        if self.file.tell() > 0:
+            with open(path, 'rb') as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b'\n':
+                    self.file.write('\n')
+
+    def __len__(self):
+        return len(self.keys)
+
+    def is_done(self, relative_path):
+        return path_key(relative_path) in self.keys
+
+    def mark_done(self, relative_path):
+        with self.lock:
+            self.keys.add(path_key(relative_path))
+            self.file.write(relative_path + '\n')
+            self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+def pending_image_paths(data_path, checkpoint=None, shard=0, nb_shards=1, recursive=True, output_dir=None):
+    # paths of the images of data_path in the given shard and not yet done, yielded while the directories are scanned
+    # images under output_dir are the results of a previous run when it lies in data_path and are skipped
+    output_dir = os.path.abspath(output_dir) if output_dir else None
+    for image_path in iter_image_paths(data_path, recursive=recursive):
+        if output_dir and os.path.commonpath([output_dir, os.path.abspath(image_path)]) == output_dir:
+            continue
+        relative_path = os.path.relpath(image_path, data_path)
+        if nb_shards > 1 and not in_shard(relative_path, shard, nb_shards):
+            continue
+        if checkpoint is not None and checkpoint.is_done(relative_path):
+            continue
+        yield image_path
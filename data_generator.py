@@ -5,47 +5,118 @@ import numpy as np
 from keras.utils import Sequence
 
 from data_processor import get_image_paths, load_annotation, check_and_validate_polys, crop_area, \
-    pad_image, resize_image, generate_rbox
+    pad_image, resize_image, generate_rbox, normalize_image
+from sample_cache import load_cached, save_cached
+from packed_dataset import PackedDataset
 
 
 class DataGenerator(Sequence):
 
-    def __init__(self, input_size, batch_size, data_path, FLAGS, is_train=True):
+    def __init__(self, input_size, batch_size, data_path, FLAGS, is_train=True, cache_dir=None):
         self.input_size = input_size
         self.batch_size = batch_size
-        self.image_paths = get_image_paths(data_path)
         self.FLAGS = FLAGS
         self.is_train = is_train
+        # decoded samples (training) or complete targets (validation) are stored here, see sample_cache.py
+        self.cache_dir = cache_dir
 
-    def __getitem__(self, index):
+        self.seeded_pid = os.getpid()
+
+        # training samples that failed to load or were filtered out are replaced by samples drawn from a shuffled
+        # backlog, a batch gives up after max_attempts_per_sample * batch_size loads
+        # validation batches hold each of their samples once and are only shorter when some fail, so that the
+        # validation loss does not depend on random replacements
+        self.max_attempts_per_sample = 10
+        self.backlog = []
+        # replacements drawn for samples that failed, the ones topping up a short slice such as the last batch of an
+        # epoch are not retries
+        self.nb_retries = 0
+        self.nb_failures = 0
 
-        images = []
-        score_maps = []
-        geo_maps = []
-        overly_small_text_region_training_masks = []
-        text_region_boundary_training_masks = []
+        # data_path is either a directory of images and annotations or a file written by packed_dataset.py
+        # image_paths then holds the names of the samples in the packed file, it is already decoded so the cache is
+        # not used
+        if os.path.isfile(data_path):
+            self.packed_dataset = PackedDataset(data_path)
+            self.image_paths = list(self.packed_dataset.names)
+            self.cache_dir = None
+        else:
+            self.packed_dataset = None
+            self.image_paths = get_image_paths(data_path)
 
+    def __getitem__(self, index):
         batch_image_paths = self.image_paths[index * self.batch_size:(index + 1) * self.batch_size]
-        for image_path in batch_image_paths:
+
+        image, overly_small_text_region_training_mask, text_region_boundary_training_mask, score_map, geo_map = \
+            self.allocate_batch()
+        n = self.fill_batch([image, overly_small_text_region_training_mask, text_region_boundary_training_mask,
+                             score_map, geo_map], batch_image_paths)
+        if n == 0:
+            raise RuntimeError('No valid sample after {} attempts'.format(self.max_attempts(batch_image_paths)))
+        return [image[:n], overly_small_text_region_training_mask[:n], text_region_boundary_training_mask[:n],
+                score_map[:n]], [score_map[:n], geo_map[:n]]
+
+    def batch_shapes(self):
+        # shapes of a sample of the image, overly small text region training mask, text region boundary training
+        # mask, score map and geo map
+        geo_map_channels = 5 if self.FLAGS.geometry == 'RBOX' else 8
+        output_size = self.input_size // 4
+        return [
+            (self.input_size, self.input_size, 3),
+            (output_size, output_size, 1),
+            (output_size, output_size, 1),
+            (output_size, output_size, 1),
+            (output_size, output_size, geo_map_channels),
+        ]
+
+    def allocate_batch(self):
+        return [np.empty((self.batch_size,) + shape, dtype=np.float32) for shape in self.batch_shapes()]
+
+    def next_replacement(self):
+        if len(self.backlog) == 0:
+            self.backlog = list(self.image_paths)
+            np.random.shuffle(self.backlog)
+        return self.backlog.pop()
+
+    def max_attempts(self, image_paths):
+        return self.max_attempts_per_sample * self.batch_size if self.is_train else len(image_paths)
+
+    def fill_batch(self, arrays, image_paths):
+        # loads the samples of image_paths into arrays, laid out as in batch_shapes, returns the number of samples
+        # written, training batches are filled up to batch_size with replacements and are only shorter when
+        # max_attempts_per_sample * batch_size loads did not give enough valid samples
+        image_paths = list(image_paths)
+        n = 0
+        # failures not yet made up for by a replacement
+        nb_pending = 0
+        for attempt in range(self.max_attempts(image_paths)):
+            if n == self.batch_size:
+                break
+            if attempt < len(image_paths):
+                image_path = image_paths[attempt]
+            else:
+                image_path = self.next_replacement()
+                if nb_pending > 0:
+                    nb_pending -= 1
+                    self.nb_retries += 1
+
             try:
                 res = self.load_training(image_path) if self.is_train else self.load_validation(image_path)
-                if res is not None:
-                    image, score_map, geo_map, overly_small_text_region_training_mask, text_region_boundary_training_mask = res
-                    images.append(image)
-                    score_maps.append(score_map)
-                    geo_maps.append(geo_map)
-                    overly_small_text_region_training_masks.append(overly_small_text_region_training_mask)
-                    text_region_boundary_training_masks.append(text_region_boundary_training_mask)
             except Exception:
-                pass
-        A, B = [np.array(images), np.array(overly_small_text_region_training_masks),
-                np.array(text_region_boundary_training_masks), np.array(score_maps)], [np.array(score_maps),
-                                                                                       np.array(geo_maps)]
+                res = None
+            if res is None:
+                self.nb_failures += 1
+                nb_pending += 1
+                continue
 
-        if self.is_valid(A, B):
-            return A, B
-        else:
-            return self.__getitem__(index)
+            # the image is normalized straight into the batch, the maps are copied
+            image, score_map, geo_map, overly_small_text_region_training_mask, text_region_boundary_training_mask = res
+            normalize_image(image, out=arrays[0][n])
+            for array, value in zip(arrays[1:], [overly_small_text_region_training_mask,
+                                                 text_region_boundary_training_mask, score_map, geo_map]):
+                array[n] = value
+            n += 1
+        return n
 
     def __len__(self):
         return int(np.ceil(len(self.image_paths) / float(self.batch_size)))
@@ -53,15 +124,43 @@ class DataGenerator(Sequence):
     def on_epoch_end(self):
         np.random.shuffle(self.image_paths)
 
+    def read_sample(self, image_path):
+        # decoded image and parsed annotation from the packed dataset or the image directory
+        if self.packed_dataset is not None:
+            return self.packed_dataset.load(image_path)
+
+        image = cv2.imread(image_path)
+        text_polys, text_tags = load_annotation(image_path, cache=True)
+        return image, text_polys, text_tags
+
+    def load_sample(self, image_path):
+        # decoded image and parsed annotation, from the cache when possible
+        if self.cache_dir:
+            cached = load_cached(self.cache_dir, image_path, 'sample')
+            if cached is not None:
+                return cached['image'], cached['text_polys'], cached['text_tags']
+
+        image, text_polys, text_tags = self.read_sample(image_path)
+        if self.cache_dir and text_polys is not None:
+            save_cached(self.cache_dir, image_path, 'sample', image=image, text_polys=text_polys, text_tags=text_tags)
+        return image, text_polys, text_tags
+
+    def seed_process(self, seed=None):
+        # seeds np.random of the current process, with None from os entropy
+        np.random.seed(seed)
+        self.seeded_pid = os.getpid()
+
     def load_training(self, image_path):
         FLAGS = self.FLAGS
 
-        image = cv2.imread(image_path)
-        h, w, _ = image.shape
+        # forked workers inherit the random state of the parent and would all produce the same augmentations
+        if self.seeded_pid != os.getpid():
+            self.seed_process()
 
-        text_polys, text_tags = load_annotation(image_path)
+        image, text_polys, text_tags = self.load_sample(image_path)
         if text_polys is None:
             return
+        h, w, _ = image.shape
 
         text_polys, text_tags = check_and_validate_polys(FLAGS, text_polys, text_tags, (h, w))
 
@@ -100,9 +199,8 @@ class DataGenerator(Sequence):
             score_map, geo_map, overly_small_text_region_training_mask, text_region_boundary_training_mask = generate_rbox(
                 FLAGS, (new_h, new_w), text_polys, text_tags)
 
-        image = (image / 127.5) - 1.
         return (
-            image[:, :, ::-1].astype(np.float32),
+            image,
             score_map[::4, ::4, np.newaxis].astype(np.float32),
             geo_map[::4, ::4, :].astype(np.float32),
             overly_small_text_region_training_mask[::4, ::4, np.newaxis].astype(np.float32),
@@ -112,12 +210,19 @@ class DataGenerator(Sequence):
     def load_validation(self, image_path):
         FLAGS = self.FLAGS
 
-        image = cv2.imread(image_path)
-        h, w, _ = image.shape
+        # validation targets are deterministic, they only depend on the sample and these params
+        params = (self.input_size, FLAGS.min_text_size)
+        if self.cache_dir:
+            cached = load_cached(self.cache_dir, image_path, 'validation', params)
+            if cached is not None:
+                return self.to_float_sample(cached['image'], cached['score_map'], cached['geo_map'],
+                                            cached['overly_small_text_region_training_mask'],
+                                            cached['text_region_boundary_training_mask'])
 
-        text_polys, text_tags = load_annotation(image_path)
+        image, text_polys, text_tags = self.read_sample(image_path)
         if text_polys is None:
             return
+        h, w, _ = image.shape
 
         text_polys, text_tags = check_and_validate_polys(FLAGS, text_polys, text_tags, (h, w))
         image, shift_h, shift_w = pad_image(image, self.input_size, is_train=False)
@@ -127,20 +232,26 @@ class DataGenerator(Sequence):
         score_map, geo_map, overly_small_text_region_training_mask, text_region_boundary_training_mask = generate_rbox(
             FLAGS, (new_h, new_w), text_polys, text_tags)
 
-        image = (image / 127.5) - 1.
+        score_map = score_map[::4, ::4]
+        geo_map = geo_map[::4, ::4, :]
+        overly_small_text_region_training_mask = overly_small_text_region_training_mask[::4, ::4]
+        text_region_boundary_training_mask = text_region_boundary_training_mask[::4, ::4]
+        if self.cache_dir:
+            save_cached(self.cache_dir, image_path, 'validation', params, image=image, score_map=score_map,
+                        geo_map=geo_map, overly_small_text_region_training_mask=overly_small_text_region_training_mask,
+                        text_region_boundary_training_mask=text_region_boundary_training_mask)
+
+        return self.to_float_sample(image, score_map, geo_map, overly_small_text_region_training_mask,
+                                    text_region_boundary_training_mask)
+
+    def to_float_sample(self, image, score_map, geo_map, overly_small_text_region_training_mask,
+                        text_region_boundary_training_mask):
+        # model targets from the maps already downsampled to the output size, the uint8 bgr image is kept as is and
+        # normalized by fill_batch
         return (
-            image[:, :, ::-1].astype(np.float32),
-            score_map[::4, ::4, np.newaxis].astype(np.float32),
-            geo_map[::4, ::4, :].astype(np.float32),
-            overly_small_text_region_training_mask[::4, ::4, np.newaxis].astype(np.float32),
-            text_region_boundary_training_mask[::4, ::4, np.newaxis].astype(np.float32)
+            image,
+            score_map[:, :, np.newaxis].astype(np.float32),
+            geo_map.astype(np.float32),
+            overly_small_text_region_training_mask[:, :, np.newaxis].astype(np.float32),
+            text_region_boundary_training_mask[:, :, np.newaxis].astype(np.float32)
         )
-
-    def is_valid(self, A, B):
-        for a in A:
-            if len(a.shape) < 4:
-                return False
-        for b in B:
-            if len(b.shape) < 4:
-                return False
-        return True
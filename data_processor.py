@@ -1,61 +1,103 @@
 import os
 import re
+import json
+from functools import lru_cache
 
 import cv2
 import numpy as np
-import pandas as pd
 
 from shapely.geometry import Polygon
 
 
-def get_image_paths(data_path):
-    allowed_extensions = ['jpg', 'png', 'jpeg', 'JPG']
-    files = [os.path.join(data_path, file) for file in os.listdir(data_path) if
-             any(file.endswith(ext) for ext in allowed_extensions)]
-    return files
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+NON_NUMERIC = re.compile(r'[^0-9.]+')
+
+# model input of every uint8 pixel value, (value / 127.5) - 1 computed in float64 and rounded once to float32
+NORMALIZE_LUT = ((np.arange(256) / 127.5) - 1).astype(np.float32)
 
 
-def load_annotation(image_path):
+def get_image_paths(data_path):
+    return list(iter_image_paths(data_path, recursive=False))
+
+
+def iter_image_paths(data_path, recursive=True):
+    # images of data_path and, when recursive, of its subdirectories, yielded while the directories are scanned so
+    # that memory does not grow with the number of images, extensions are compared case insensitively
+    # symbolic links to directories are not followed, they could form cycles
+    directories = [data_path]
+    while len(directories) > 0:
+        directory = directories.pop()
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    if recursive:
+                        directories.append(entry.path)
+                elif os.path.splitext(entry.name)[1].lower() in IMAGE_EXTENSIONS:
+                    yield entry.path
+
+
+def get_annotation_paths(image_path):
     change_ext = lambda x, ext: x.replace(os.path.basename(x).split('.')[1], ext)
-    text_path = change_ext(image_path, 'txt')
-    json_path = change_ext(image_path, 'json')
+    return change_ext(image_path, 'json'), change_ext(image_path, 'txt')
 
-    return load_annotation_json(json_path) if os.path.exists(json_path) \
-        else (load_annotation_txt(text_path) if os.path.exists(text_path) else (None, None))
 
+def load_annotation(image_path, cache=False):
+    # param cache: keep the parsed annotations of this process in an lru cache, entries are keyed by the path and
+    # modification time of the annotation file
+    json_path, text_path = get_annotation_paths(image_path)
 
-def load_annotation_json(json_path):
-    df = pd.read_json(json_path)
+    path = json_path if os.path.exists(json_path) else (text_path if os.path.exists(text_path) else None)
+    if path is None:
+        return None, None
+    if not cache:
+        return parse_annotation(path)
 
-    def parse(row):
-        x1, y1, x2, y2, x3, y3, x4, y4 = row['line']
-        line = [[x1, y1], [x2, y2], [x3, y3], [x4, y4]]
-        label = row['text'] == '*' or row['text'] == '###'
-        return line, label
+    # callers modify the polygons in place, hand out copies of the cached arrays
+    text_polys, text_tags = parse_annotation_cached(path, os.path.getmtime(path))
+    return text_polys.copy(), text_tags.copy()
 
-    parsed = df.apply(parse, axis=1)
-    text_polys = [i[0] for i in parsed]
-    text_tags = [i[1] for i in parsed]
-    return np.array(text_polys, dtype=np.float32), np.array(text_tags, dtype=np.bool)
 
+@lru_cache(maxsize=4096)
+def parse_annotation_cached(path, mtime):
+    return parse_annotation(path)
 
-def load_annotation_txt(txt_path):
-    file = open(txt_path)
-    lines = file.readlines()
-    file.close()
 
-    def parse(line):
-        line = line.split(',')
-        x1, y1, x2, y2, x3, y3, x4, y4 = list(map(lambda item: float(re.sub(r'[^0-9.]+', '', item)), line[:8]))
-        a = [[x1, y1], [x2, y2], [x3, y3], [x4, y4]]
-        text = line[8].strip()
-        b = text == '*' or text == '###'
-        return a, b
+def parse_annotation(path):
+    # single parser for both annotation formats, returns the polygons as an (n, 4, 2) float32 array and the tags of
+    # the polygons to ignore as an (n,) bool array
+    if path.endswith('.json'):
+        with open(path, encoding='utf-8') as f:
+            records = [(record['line'], record['text']) for record in json.load(f)]
+    else:
+        with open(path) as f:
+            records = [parse_annotation_txt_line(line) for line in f if line.strip()]
+
+    text_polys = np.empty((len(records), 4, 2), dtype=np.float32)
+    text_tags = np.empty(len(records), dtype=np.bool)
+    for i, (line, text) in enumerate(records):
+        text_polys[i].flat = line
+        text_tags[i] = text == '*' or text == '###'
+    return text_polys, text_tags
 
-    parsed = list(map(parse, lines))
-    text_polys = [i[0] for i in parsed]
-    text_tags = [i[1] for i in parsed]
-    return np.array(text_polys, dtype=np.float32), np.array(text_tags, dtype=np.bool)
+
+def parse_annotation_txt_line(line):
+    line = line.split(',')
+    coordinates = []
+    for item in line[:8]:
+        stripped = item.strip()
+        # anything but digits and dots is dropped from the coordinates, e.g. a byte order mark
+        coordinates.append(float(stripped) if stripped.isdigit() else float(NON_NUMERIC.sub('', item)))
+    if len(coordinates) < 8:
+        raise ValueError('Invalid annotation line: {}'.format(','.join(line)))
+    return coordinates, line[8].strip()
+
+
+def load_annotation_json(json_path):
+    return parse_annotation(json_path)
+
+
+def load_annotation_txt(txt_path):
+    return parse_annotation(txt_path)
 
 
 # %%
@@ -143,6 +185,17 @@ def point_dist_to_line(p1, p2, p3):
     return alt if d == 0.0 else np.linalg.norm(np.cross(p2 - p1, p1 - p3)) / d
 
 
+def points_dist_to_line(p1, p2, points):
+    # point_dist_to_line for an (n, 2) array of points at once
+    d = np.linalg.norm(p2 - p1)
+    if d == 0.0:
+        return np.full(points.shape[0], np.nan, dtype=points.dtype)
+
+    edge = p2 - p1
+    to_p1 = p1 - points
+    return np.abs(edge[0] * to_p1[:, 1] - edge[1] * to_p1[:, 0]) / d
+
+
 def line_cross_point(FLAGS, line1, line2):
     # line1 0= ax+by+c, compute the cross point of line1 and line2
     if line1[0] != 0 and line1[0] == line2[0]:
@@ -377,18 +430,18 @@ def generate_rbox(FLAGS, im_size, polys, tags):
         rectange, rotate_angle = sort_rectangle(FLAGS, rectange)
 
         p0_rect, p1_rect, p2_rect, p3_rect = rectange
-        for y, x in xy_in_poly:
-            point = np.array([x, y], dtype=np.float32)
-            # top
-            geo_map[y, x, 0] = point_dist_to_line(p0_rect, p1_rect, point)
-            # right
-            geo_map[y, x, 1] = point_dist_to_line(p1_rect, p2_rect, point)
-            # down
-            geo_map[y, x, 2] = point_dist_to_line(p2_rect, p3_rect, point)
-            # left
-            geo_map[y, x, 3] = point_dist_to_line(p3_rect, p0_rect, point)
-            # angle
-            geo_map[y, x, 4] = rotate_angle
+        ys, xs = xy_in_poly[:, 0], xy_in_poly[:, 1]
+        points = xy_in_poly[:, ::-1].astype(np.float32)
+        # top
+        geo_map[ys, xs, 0] = points_dist_to_line(p0_rect, p1_rect, points)
+        # right
+        geo_map[ys, xs, 1] = points_dist_to_line(p1_rect, p2_rect, points)
+        # down
+        geo_map[ys, xs, 2] = points_dist_to_line(p2_rect, p3_rect, points)
+        # left
+        geo_map[ys, xs, 3] = points_dist_to_line(p3_rect, p0_rect, points)
+        # angle
+        geo_map[ys, xs, 4] = rotate_angle
 
     shrinked_poly_mask = (shrinked_poly_mask > 0).astype('uint8')
     text_region_boundary_training_mask = 1 - (orig_poly_mask - shrinked_poly_mask)
@@ -460,62 +513,88 @@ def resize_image(img, text_polys, input_size, shift_h, shift_w):
     return img, text_polys
 
 
+def normalize_image(img, out=None):
+    # uint8 bgr image to the normalized float32 rgb input of the model, in one pass without float64 temporaries
+    # param out: float32 array of the same shape the result is written into, e.g. a slice of a batch
+    rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+    if out is None:
+        return cv2.LUT(rgb, NORMALIZE_LUT)
+    if out.flags['C_CONTIGUOUS']:
+        cv2.LUT(rgb, NORMALIZE_LUT, dst=out)
+    else:
+        # cv2 cannot write into strided views, e.g. the top left corner of a padded batch
+        out[...] = cv2.LUT(rgb, NORMALIZE_LUT)
+    return out
+
+
 def crop_area(FLAGS, im, polys, tags, crop_background=False, max_tries=50):
     # make random crop from the input image
     h, w, _ = im.shape
     pad_h = h // 10
     pad_w = w // 10
-    h_array = np.zeros((h + pad_h * 2), dtype=np.int32)
-    w_array = np.zeros((w + pad_w * 2), dtype=np.int32)
-    for poly in polys:
-        poly = np.round(poly, decimals=0).astype(np.int32)
-        minx = np.min(poly[:, 0])
-        maxx = np.max(poly[:, 0])
-        w_array[minx + pad_w:maxx + pad_w] = 1
-        miny = np.min(poly[:, 1])
-        maxy = np.max(poly[:, 1])
-        h_array[miny + pad_h:maxy + pad_h] = 1
+    h_array = mark_spans(polys, 1, h + pad_h * 2, pad_h)
+    w_array = mark_spans(polys, 0, w + pad_w * 2, pad_w)
     # ensure the cropped area not across a text
     h_axis = np.where(h_array == 0)[0]
     w_axis = np.where(w_array == 0)[0]
     if len(h_axis) == 0 or len(w_axis) == 0:
         return im, polys, tags
-    for i in range(max_tries):
-        xx = np.random.choice(w_axis, size=2)
-        xmin = np.min(xx) - pad_w
-        xmax = np.max(xx) - pad_w
-        xmin = np.clip(xmin, 0, w - 1)
-        xmax = np.clip(xmax, 0, w - 1)
-        yy = np.random.choice(h_axis, size=2)
-        ymin = np.min(yy) - pad_h
-        ymax = np.max(yy) - pad_h
-        ymin = np.clip(ymin, 0, h - 1)
-        ymax = np.clip(ymax, 0, h - 1)
-        if xmax - xmin < FLAGS.min_crop_side_ratio * w or ymax - ymin < FLAGS.min_crop_side_ratio * h:
-            # area too small
-            continue
-        if polys.shape[0] != 0:
-            poly_axis_in_area = (polys[:, :, 0] >= xmin) & (polys[:, :, 0] <= xmax) \
-                                & (polys[:, :, 1] >= ymin) & (polys[:, :, 1] <= ymax)
-            selected_polys = np.where(np.sum(poly_axis_in_area, axis=1) == 4)[0]
-        else:
-            selected_polys = []
-        if len(selected_polys) == 0:
-            # no text in this area
-            if crop_background:
-                return im[ymin:ymax + 1, xmin:xmax + 1, :], polys[selected_polys], tags[selected_polys]
-            else:
-                continue
-        im = im[ymin:ymax + 1, xmin:xmax + 1, :]
-        polys = polys[selected_polys]
-        tags = tags[selected_polys]
-        polys[:, :, 0] -= xmin
-        polys[:, :, 1] -= ymin
-        return im, polys, tags
 
+    # all the tries at once, one row per try
+    xx = np.random.choice(w_axis, size=(max_tries, 2))
+    yy = np.random.choice(h_axis, size=(max_tries, 2))
+    xmin = np.clip(np.min(xx, axis=1) - pad_w, 0, w - 1)
+    xmax = np.clip(np.max(xx, axis=1) - pad_w, 0, w - 1)
+    ymin = np.clip(np.min(yy, axis=1) - pad_h, 0, h - 1)
+    ymax = np.clip(np.max(yy, axis=1) - pad_h, 0, h - 1)
+    # area too small
+    large_enough = (xmax - xmin >= FLAGS.min_crop_side_ratio * w) & (ymax - ymin >= FLAGS.min_crop_side_ratio * h)
+
+    # tries x polys, whether every vertex of the poly is inside the crop of the try
+    if polys.shape[0] != 0:
+        poly_in_area = np.all((polys[np.newaxis, :, :, 0] >= xmin[:, np.newaxis, np.newaxis])
+                              & (polys[np.newaxis, :, :, 0] <= xmax[:, np.newaxis, np.newaxis])
+                              & (polys[np.newaxis, :, :, 1] >= ymin[:, np.newaxis, np.newaxis])
+                              & (polys[np.newaxis, :, :, 1] <= ymax[:, np.newaxis, np.newaxis]), axis=2)
+    else:
+        poly_in_area = np.zeros((max_tries, 0), dtype=np.bool)
+    has_text = np.any(poly_in_area, axis=1)
+
+    # the first try that would have been accepted, a crop without text is only accepted for background crops
+    accepted = np.where(large_enough & (has_text | crop_background))[0]
+    if len(accepted) == 0:
+        return im, polys, tags
+    i = accepted[0]
+    xmin, xmax, ymin, ymax = xmin[i], xmax[i], ymin[i], ymax[i]
+    selected_polys = np.where(poly_in_area[i])[0]
+    if len(selected_polys) == 0:
+        # no text in this area
+        return im[ymin:ymax + 1, xmin:xmax + 1, :], polys[selected_polys], tags[selected_polys]
+
+    im = im[ymin:ymax + 1, xmin:xmax + 1, :]
+    polys = polys[selected_polys]
+    tags = tags[selected_polys]
+    polys[:, :, 0] -= xmin
+    polys[:, :, 1] -= ymin
     return im, polys, tags
 
 
+def mark_spans(polys, axis, length, pad):
+    # array of the given length with ones wherever a poly spans along the axis (0 for x, 1 for y), shifted by pad
+    if polys.shape[0] == 0:
+        return np.zeros(length, dtype=np.int32)
+    coordinates = np.round(polys[:, :, axis], decimals=0).astype(np.int32)
+    starts = np.clip(np.min(coordinates, axis=1) + pad, 0, length)
+    ends = np.clip(np.max(coordinates, axis=1) + pad, 0, length)
+    non_empty = starts < ends
+
+    # +1 where a span starts and -1 where it ends, covered positions have a positive running sum
+    boundaries = np.zeros(length + 1, dtype=np.int32)
+    np.add.at(boundaries, starts[non_empty], 1)
+    np.add.at(boundaries, ends[non_empty], -1)
+    return (np.cumsum(boundaries[:-1]) > 0).astype(np.int32)
+
+
 # %%
 
 def restore_rectangle_rbox(origin, geometry):
@@ -590,5 +669,35 @@ def restore_rectangle_rbox(origin, geometry):
     return np.concatenate([new_p_0, new_p_1])
 
 
+def restore_rectangle_rbox_into(origin_x, origin_y, geometry, out):
+    # restore_rectangle_rbox in a single pass over both angle signs, the 8 coordinates of the rectangle of every
+    # origin are written to the first 8 columns of out, (n, >= 8), in the order of the origins
+    # a negative angle only moves the corners along the rotated x axis, the rotation itself is the same
+    d_top, d_right, d_bottom, d_left, angle = geometry.T
+    negative = angle < 0
+    width = d_right + d_left
+    height = d_top + d_bottom
+    cos = np.cos(angle).astype(np.float64)
+    sin = np.sin(angle).astype(np.float64)
+
+    # corners of the unrotated rectangle relative to its bottom left, respectively bottom right, corner
+    corners_x = [np.where(negative, -width, 0), np.where(negative, 0, width), np.where(negative, 0, width),
+                 np.where(negative, -width, 0)]
+    corners_y = [-height, -height, np.zeros_like(height), np.zeros_like(height)]
+
+    # the origin is at (d_left, -d_bottom), respectively (-d_right, -d_bottom), in the same frame
+    origin_in_frame_x = np.where(negative, -d_right, d_left).astype(np.float64)
+    origin_in_frame_y = -d_bottom.astype(np.float64)
+    offset_x = origin_x - (cos * origin_in_frame_x + sin * origin_in_frame_y)
+    offset_y = origin_y - (-sin * origin_in_frame_x + cos * origin_in_frame_y)
+
+    for i, (corner_x, corner_y) in enumerate(zip(corners_x, corners_y)):
+        corner_x = corner_x.astype(np.float64)
+        corner_y = corner_y.astype(np.float64)
+        out[:, 2 * i] = cos * corner_x + sin * corner_y + offset_x
+        out[:, 2 * i + 1] = -sin * corner_x + cos * corner_y + offset_y
+    return out
+
+
 def restore_rectangle(origin, geometry):
     return restore_rectangle_rbox(origin, geometry)
@@ -0,0 +1,148 @@
+import logging
+import argparse
+
+import numpy as np
+
+import tensorflow as tf
+import keras.backend as K
+from keras.models import Model
+
+from model import RESIZE_FACTOR
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--model_path', type=str, default='models/east/model-funsd400.h5')
+parser.add_argument('--output_path', type=str, default='models/east/model-funsd400.pb')
+
+# names of the tensors of the exported graph, see predict.FrozenModel
+INPUT_NAME = 'input_image'
+SCORE_MAP_NAME = 'score_map'
+GEO_MAP_NAME = 'geo_map'
+
+
+def inference_config(model):
+    # config of the model with the image as its only input and every BatchNormalization that directly follows a
+    # Conv2D removed, returns the config and a dict from the name of every such conv to the name of its batch norm
+    config = model.get_config()
+    layers = {layer['name']: layer for layer in config['layers']}
+
+    # number of times the output of every layer is used, a conv feeding anything else than its batch norm is kept
+    consumers = {name: 0 for name in layers}
+    for layer in config['layers']:
+        for node in layer['inbound_nodes']:
+            for inbound in node:
+                consumers[inbound[0]] += 1
+    for output in config['output_layers']:
+        consumers[output[0]] += 1
+
+    folded = {}
+    replacements = {}
+    for layer in config['layers']:
+        if layer['class_name'] != 'BatchNormalization' or layer['config']['axis'] not in (-1, 3):
+            continue
+        if len(layer['inbound_nodes']) != 1 or len(layer['inbound_nodes'][0]) != 1:
+            continue
+        inbound = layer['inbound_nodes'][0][0]
+        if layers[inbound[0]]['class_name'] != 'Conv2D' or consumers[inbound[0]] != 1:
+            continue
+        folded[inbound[0]] = layer['name']
+        replacements[layer['name']] = inbound
+
+    # drop the batch norms and the training inputs, consumers of a batch norm read its conv instead
+    input_layers = [name for name, _, _ in config['input_layers'] if name == INPUT_NAME]
+    config['layers'] = [layer for layer in config['layers'] if layer['name'] not in replacements and
+                        (layer['class_name'] != 'InputLayer' or layer['name'] in input_layers)]
+    for layer in config['layers']:
+        layer['inbound_nodes'] = [[replacements.get(inbound[0], inbound) for inbound in node]
+                                  for node in layer['inbound_nodes']]
+        if layer['name'] in folded:
+            layer['config']['use_bias'] = True
+    config['input_layers'] = [[INPUT_NAME, 0, 0]]
+    config['output_layers'] = [replacements.get(output[0], output)[:3] for output in config['output_layers']]
+    return config, folded
+
+
+def fold_batch_norm(conv, batch_norm):
+    # weights of a conv followed by a batch norm in inference mode, as a single conv
+    weights = conv.get_weights()
+    kernel = weights[0].astype(np.float64)
+    bias = weights[1].astype(np.float64) if conv.use_bias else np.zeros(kernel.shape[-1])
+
+    # batch norm weights are [gamma, beta, moving_mean, moving_variance], gamma and beta only when enabled
+    bn_weights = [w.astype(np.float64) for w in batch_norm.get_weights()]
+    gamma = bn_weights.pop(0) if batch_norm.scale else np.ones(kernel.shape[-1])
+    beta = bn_weights.pop(0) if batch_norm.center else np.zeros(kernel.shape[-1])
+    moving_mean, moving_variance = bn_weights
+
+    scale = gamma / np.sqrt(moving_variance + batch_norm.epsilon)
+    return [(kernel * scale).astype(np.float32), ((bias - moving_mean) * scale + beta).astype(np.float32)]
+
+
+def inference_model(model):
+    # single input keras model computing the score and geo maps of model with its batch norms folded
+    # the model is built in a new graph in inference mode, so that its input keeps the name INPUT_NAME instead of
+    # being renamed next to the input of model, which cannot be used afterwards
+    config, folded = inference_config(model)
+    weights = {}
+    for layer in config['layers']:
+        name = layer['name']
+        if name in folded:
+            weights[name] = fold_batch_norm(model.get_layer(name), model.get_layer(folded[name]))
+        elif model.get_layer(name).weights:
+            weights[name] = model.get_layer(name).get_weights()
+
+    K.clear_session()
+    K.set_learning_phase(0)
+    custom_objects = {'tf': tf, 'RESIZE_FACTOR': RESIZE_FACTOR}
+    inference = Model.from_config(config, custom_objects=custom_objects)
+    for layer in inference.layers:
+        if layer.name in weights:
+            layer.set_weights(weights[layer.name])
+    print('Folded {} batch norms into their convolutions'.format(len(folded)))
+    return inference
+
+
+def export(model, output_path):
+    # writes the graph of a single input keras model as a frozen graph with named input and outputs
+    # predict.FrozenModel and quantize_model.py feed the input by name
+    if model.inputs[0].op.name != INPUT_NAME:
+        raise ValueError('The input of the model is named {} instead of {}'.format(model.inputs[0].op.name, INPUT_NAME))
+
+    session = K.get_session()
+    tf.identity(model.outputs[0], name=SCORE_MAP_NAME)
+    tf.identity(model.outputs[1], name=GEO_MAP_NAME)
+
+    graph_def = tf.graph_util.convert_variables_to_constants(session, session.graph.as_graph_def(),
+                                                             [SCORE_MAP_NAME, GEO_MAP_NAME])
+    # the outputs are identities too, they must survive
+    graph_def = tf.graph_util.remove_training_nodes(graph_def, protected_nodes=[SCORE_MAP_NAME, GEO_MAP_NAME])
+    graph_def = tf.graph_util.extract_sub_graph(graph_def, [SCORE_MAP_NAME, GEO_MAP_NAME])
+    with tf.gfile.GFile(output_path, 'wb') as f:
+        f.write(graph_def.SerializeToString())
+    print('Wrote {} with {} nodes'.format(output_path, len(graph_def.node)))
+
+
+def main():
+    from predict import load_model
+
+    FLAGS = parser.parse_args()
+    logging.getLogger().setLevel(logging.ERROR)
+
+    # batch norms use their moving averages and dropout is disabled in the graph built from here on
+    K.set_learning_phase(0)
+    model = load_model(model_path=FLAGS.model_path)
+
+    # the folded model should give the same maps up to float rounding
+    image = np.random.uniform(-1, 1, (1, 512, 512, 3)).astype(np.float32)
+    # the training masks are only inputs of the losses, a model loaded from model.json takes the image alone
+    mask = np.ones((1, 128, 128, 1), dtype=np.float32)
+    expected = model.predict([image] + [mask] * (len(model.inputs) - 1))
+    inference = inference_model(model)
+    actual = inference.predict(image)
+    print('Max difference, score map: {:.2e}, geo map: {:.2e}'.format(np.abs(expected[0] - actual[0]).max(),
+                                                                      np.abs(expected[1] - actual[1]).max()))
+
+    export(inference, FLAGS.output_path)
+
+
+if __name__ == '__main__':
+    main()
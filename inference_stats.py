@@ -0,0 +1,116 @@
+import json
+import time
+import logging
+import threading
+from contextlib import contextmanager, nullcontext
+
+# one json line per inference when enabled, see enable_logging
+logger = logging.getLogger('inference_stats')
+
+
+class InferenceStats:
+    # seconds spent in every stage of an inference and counters such as the number of boxes before and after nms
+    # stages run several times, e.g. once per batch, add up
+
+    def __init__(self):
+        self.durations = {}
+        self.counters = {}
+        self.error = None
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.durations[name] = self.durations.get(name, 0.) + time.perf_counter() - start
+
+    def count(self, name, value):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def fail(self, error):
+        self.error = str(error)
+
+    def merge(self, other):
+        # adds the durations and counters of other, e.g. of a batch shared by several images
+        for name, duration in other.durations.items():
+            self.durations[name] = self.durations.get(name, 0.) + duration
+        for name, value in other.counters.items():
+            self.count(name, value)
+
+    def as_dict(self):
+        return {'durations': dict(self.durations), 'counters': dict(self.counters), 'error': self.error}
+
+    def log(self, **fields):
+        # fields are added to the logged json, e.g. the path of the image
+        if logger.isEnabledFor(logging.INFO):
+            logger.info(json.dumps(dict(self.as_dict(), **fields)))
+
+
+class NullStats:
+    # used when no stats are collected, every call does nothing
+    error = None
+
+    def stage(self, name):
+        return NULL_STAGE
+
+    def count(self, name, value):
+        pass
+
+    def fail(self, error):
+        pass
+
+    def merge(self, other):
+        pass
+
+    def log(self, **fields):
+        pass
+
+
+NULL_STAGE = nullcontext()
+NULL_STATS = NullStats()
+
+
+class InferenceMetrics:
+    # totals of the InferenceStats of many inferences, served by the /metrics endpoint of app.py
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.nb_inferences = 0
+        self.nb_errors = 0
+        # name -> [number of runs, total seconds, max seconds]
+        self.durations = {}
+        self.counters = {}
+
+    def add(self, stats):
+        with self.lock:
+            self.nb_inferences += 1
+            self.nb_errors += stats.error is not None
+            for name, duration in stats.durations.items():
+                runs = self.durations.setdefault(name, [0, 0., 0.])
+                runs[0] += 1
+                runs[1] += duration
+                runs[2] = max(runs[2], duration)
+            for name, value in stats.counters.items():
+                self.counters[name] = self.counters.get(name, 0) + value
+
+    def as_dict(self):
+        with self.lock:
+            return {
+                'inferences': self.nb_inferences,
+                'errors': self.nb_errors,
+                'stages': {name: {'runs': runs, 'total_seconds': total, 'mean_ms': total / runs * 1e3,
+                                  'max_ms': longest * 1e3}
+                           for name, (runs, total, longest) in self.durations.items()},
+                'counters': dict(self.counters),
+            }
+
+
+def enable_logging(path=None):
+    # writes the stats logged by InferenceStats.log to path, or to stderr
+    handler = logging.FileHandler(path) if path else logging.StreamHandler()
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    # the scripts silence the root logger
+    logger.propagate = False
@@ -3,18 +3,69 @@ import os
 import numpy as np
 
 BASE_DIR = os.path.dirname(os.path.realpath(__file__))
+# version of the functions of adaptor.cpp, an extension built from an older adaptor.cpp is refused
+ADAPTOR_VERSION = 2
+SOURCES = ['adaptor.cpp', 'lanms.h', 'include/clipper/clipper.cpp', 'include/clipper/clipper.hpp']
 
-if subprocess.call(['make', '-C', BASE_DIR]) != 0:  # return value
-    raise RuntimeError('Cannot compile lanms: {}'.format(BASE_DIR))
+
+def make():
+    if subprocess.call(['make', '-C', BASE_DIR]) != 0:  # return value
+        raise RuntimeError('Cannot compile lanms: {}'.format(BASE_DIR))
+
+
+def is_stale(path):
+    # whether the extension at path is older than one of the sources, an extension once loaded cannot be replaced
+    # so this is checked before the import
+    return os.path.exists(path) and any(os.path.getmtime(os.path.join(BASE_DIR, source)) > os.path.getmtime(path)
+                                        for source in SOURCES if os.path.exists(os.path.join(BASE_DIR, source)))
+
+
+# adaptor.so is built in place by the Makefile, e.g. by an earlier version of this file, make rebuilds it
+if is_stale(os.path.join(BASE_DIR, 'adaptor.so')):
+    make()
+
+try:
+    # prebuilt extension, see setup.py
+    from . import adaptor
+except ImportError:
+    # fall back to compiling the extension in place with the Makefile
+    make()
+    from . import adaptor
+
+if getattr(adaptor, 'VERSION', None) != ADAPTOR_VERSION:
+    raise RuntimeError('{} was built from an older adaptor.cpp, rebuild it with make -C {} or '
+                       'python setup.py build_ext --inplace'.format(adaptor.__file__, BASE_DIR))
 
 
 def merge_quadrangle_n9(polys, thres=0.3, precision=10000):
-    from .adaptor import merge_quadrangle_n9 as nms_impl
     if len(polys) == 0:
         return np.array([], dtype='float32')
-    p = polys.copy()
-    p[:,:8] *= precision
-    ret = np.array(nms_impl(p, thres), dtype='float32')
-    ret[:,:8] /= precision
-    return ret
+    return adaptor.merge_quadrangle_n9(polys, thres, precision)
+
+
+def merge_quadrangle_n9_batch(polys_list, thres=0.3, precision=10000, nb_threads=0):
+    # merge_quadrangle_n9 for the candidates of several images, the images are processed in parallel by
+    # nb_threads native threads (all cores when nb_threads <= 0) without holding the GIL
+    polys_list = [polys if len(polys) > 0 else np.zeros((0, 9), dtype='float32') for polys in polys_list]
+    return adaptor.merge_quadrangle_n9_batch(polys_list, thres, precision, nb_threads)
+
+
+def standard_nms(polys, thres=0.3, precision=10000, spatial_index=True):
+    # plain nms without the locality-aware merging pass, polys is an (n, 9) array
+    # spatial_index only compares quadrangles whose bounding boxes overlap, the result is the same
+    if len(polys) == 0:
+        return np.array([], dtype='float32')
+    return adaptor.standard_nms(polys, thres, precision, spatial_index)
+
 
+def iou_matrix(polys_a, polys_b, precision=10000):
+    # (n, m) array of the iou of every pair of quadrangles, computed like the nms does
+    # the quadrangles are given as (n, 8), (n, 9) or (n, 4, 2) arrays, a score column is ignored
+    quad_n9s = []
+    for polys in (polys_a, polys_b):
+        polys = np.asarray(polys, dtype='float32')
+        quad_n9 = np.zeros((len(polys), 9), dtype='float32')
+        if len(polys) > 0:
+            quad_n9[:, :8] = polys.reshape((len(polys), -1))[:, :8]
+        quad_n9s.append(quad_n9)
+    return adaptor.iou_matrix(quad_n9s[0], quad_n9s[1], precision)
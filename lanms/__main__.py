@@ -1,10 +1,52 @@
+import sys
+import time
+
 import numpy as np
 
 
-from . import merge_quadrangle_n9
+from . import merge_quadrangle_n9, standard_nms
+
+
+def random_candidates(n, rng, copies=4, page_size=2400):
+    # n quadrangles, words scattered over a page with a few jittered copies of each word
+    nb_words = max(n // copies, 1)
+    x = rng.rand(nb_words) * page_size
+    y = rng.rand(nb_words) * page_size
+    w = rng.rand(nb_words) * 150 + 20
+    h = rng.rand(nb_words) * 20 + 10
+    quads = np.stack([x, y, x + w, y, x + w, y + h, x, y + h], axis=1)
+    quads = np.repeat(quads, copies, axis=0)[:n]
+    quads += rng.randn(*quads.shape) * 2
+    scores = rng.rand(quads.shape[0], 1) * 0.2 + 0.8
+    return np.hstack([quads, scores]).astype('float32')
+
+
+def benchmark(sizes=(500, 1000, 2000, 4000, 8000, 16000), naive_max=8000, thres=0.2):
+    # throughput of standard_nms with and without the spatial index as the number of candidates grows
+    rng = np.random.RandomState(0)
+    print('{:>8} {:>14} {:>14} {:>8}'.format('n', 'naive (q/s)', 'indexed (q/s)', 'speedup'))
+    for n in sizes:
+        polys = random_candidates(n, rng)
+
+        start = time.perf_counter()
+        indexed = standard_nms(polys, thres, spatial_index=True)
+        t_indexed = time.perf_counter() - start
+
+        if n <= naive_max:
+            start = time.perf_counter()
+            naive = standard_nms(polys, thres, spatial_index=False)
+            t_naive = time.perf_counter() - start
+            assert np.array_equal(naive, indexed), 'spatial index changed the nms result'
+            print('{:>8} {:>14.0f} {:>14.0f} {:>7.1f}x'.format(n, n / t_naive, n / t_indexed, t_naive / t_indexed))
+        else:
+            print('{:>8} {:>14} {:>14.0f} {:>8}'.format(n, '-', n / t_indexed, '-'))
+
 
 if __name__ == '__main__':
-    # unit square with confidence 1
-    q = np.array([0, 0, 0, 1, 1, 1, 1, 0, 1], dtype='float32')
+    if len(sys.argv) > 1 and sys.argv[1] == 'benchmark':
+        benchmark()
+    else:
+        # unit square with confidence 1
+        q = np.array([0, 0, 0, 1, 1, 1, 1, 0, 1], dtype='float32')
 
-    print(merge_quadrangle_n9(np.array([q, q + 0.1, q + 2])))
+        print(merge_quadrangle_n9(np.array([q, q + 0.1, q + 2])))
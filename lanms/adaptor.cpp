@@ -3,6 +3,12 @@
 #include "pybind11/stl.h"
 #include "pybind11/stl_bind.h"
 
+#include <algorithm>
+#include <atomic>
+#include <exception>
+#include <mutex>
+#include <thread>
+
 #include "lanms.h"
 
 namespace py = pybind11;
@@ -10,18 +16,18 @@ namespace py = pybind11;
 
 namespace lanms_adaptor {
 
-	std::vector<std::vector<float>> polys2floats(const std::vector<lanms::Polygon> &polys) {
-		std::vector<std::vector<float>> ret;
+	py::array_t<float> polys2array(const std::vector<lanms::Polygon> &polys, float precision) {
+		py::array_t<float> ret(std::vector<size_t>{polys.size(), 9});
+		auto ptr = ret.mutable_data();
 		for (size_t i = 0; i < polys.size(); i ++) {
 			auto &p = polys[i];
 			auto &poly = p.poly;
-			ret.emplace_back(std::vector<float>{
-					float(poly[0].X), float(poly[0].Y),
-					float(poly[1].X), float(poly[1].Y),
-					float(poly[2].X), float(poly[2].Y),
-					float(poly[3].X), float(poly[3].Y),
-					float(p.score),
-					});
+			auto row = ptr + i * 9;
+			for (size_t j = 0; j < 4; j ++) {
+				row[j * 2] = float(poly[j].X) / precision;
+				row[j * 2 + 1] = float(poly[j].Y) / precision;
+			}
+			row[8] = float(p.score);
 		}
 
 		return ret;
@@ -34,18 +40,174 @@ namespace lanms_adaptor {
 	 *		quadrangle, and the last one is the score
 	 * \param iou_threshold two quadrangles with iou score above this threshold
 	 *		will be merged
+	 * \param precision coordinates are multiplied by this factor before being
+	 *		rounded to the integer grid used by clipper
 	 *
 	 * \return an n-by-9 numpy array, the merged quadrangles
 	 */
-	std::vector<std::vector<float>> merge_quadrangle_n9(
+	py::array_t<float> merge_quadrangle_n9(
+			py::array_t<float, py::array::c_style | py::array::forcecast> quad_n9,
+			float iou_threshold,
+			float precision) {
+		auto pbuf = quad_n9.request();
+		if (pbuf.ndim != 2 || pbuf.shape[1] != 9)
+			throw std::runtime_error("quadrangles must have a shape of (n, 9)");
+		auto n = pbuf.shape[0];
+		auto ptr = static_cast<float *>(pbuf.ptr);
+		std::vector<lanms::Polygon> polys;
+		{
+			py::gil_scoped_release release;
+			polys = lanms::merge_quadrangle_n9(ptr, n, iou_threshold, precision);
+		}
+		return polys2array(polys, precision);
+	}
+
+
+	/**
+	 *
+	 * \param quad_n9 an n-by-9 numpy array, where first 8 numbers denote the
+	 *		quadrangle, and the last one is the score
+	 * \param iou_threshold quadrangles with iou score above this threshold
+	 *		with a higher scored quadrangle are suppressed
+	 * \param precision coordinates are multiplied by this factor before being
+	 *		rounded to the integer grid used by clipper
+	 * \param spatial_index only compare quadrangles with overlapping bounding
+	 *		boxes instead of every pair
+	 *
+	 * \return an n-by-9 numpy array, the kept quadrangles
+	 */
+	py::array_t<float> standard_nms(
 			py::array_t<float, py::array::c_style | py::array::forcecast> quad_n9,
-			float iou_threshold) {
+			float iou_threshold,
+			float precision,
+			bool spatial_index) {
 		auto pbuf = quad_n9.request();
 		if (pbuf.ndim != 2 || pbuf.shape[1] != 9)
 			throw std::runtime_error("quadrangles must have a shape of (n, 9)");
 		auto n = pbuf.shape[0];
 		auto ptr = static_cast<float *>(pbuf.ptr);
-		return polys2floats(lanms::merge_quadrangle_n9(ptr, n, iou_threshold));
+		std::vector<lanms::Polygon> polys;
+		{
+			py::gil_scoped_release release;
+			for (size_t i = 0; i < size_t(n); i ++)
+				polys.emplace_back(lanms::poly_from_n9(ptr + i * 9, precision));
+			polys = spatial_index ? lanms::standard_nms(polys, iou_threshold)
+				: lanms::standard_nms_naive(polys, iou_threshold);
+		}
+		return polys2array(polys, precision);
+	}
+
+
+	/**
+	 *
+	 * \param quad_n9_a an n-by-9 numpy array of quadrangles, scores are ignored
+	 * \param quad_n9_b an m-by-9 numpy array of quadrangles, scores are ignored
+	 * \param precision coordinates are multiplied by this factor before being
+	 *		rounded to the integer grid used by clipper
+	 *
+	 * \return an n-by-m numpy array, the iou of every pair of quadrangles as
+	 *		computed by the nms
+	 */
+	py::array_t<float> iou_matrix(
+			py::array_t<float, py::array::c_style | py::array::forcecast> quad_n9_a,
+			py::array_t<float, py::array::c_style | py::array::forcecast> quad_n9_b,
+			float precision) {
+		auto abuf = quad_n9_a.request(), bbuf = quad_n9_b.request();
+		if (abuf.ndim != 2 || abuf.shape[1] != 9 || bbuf.ndim != 2 || bbuf.shape[1] != 9)
+			throw std::runtime_error("quadrangles must have a shape of (n, 9)");
+		size_t n = abuf.shape[0], m = bbuf.shape[0];
+		auto aptr = static_cast<float *>(abuf.ptr), bptr = static_cast<float *>(bbuf.ptr);
+
+		py::array_t<float> ret(std::vector<size_t>{n, m});
+		auto ptr = ret.mutable_data();
+		{
+			py::gil_scoped_release release;
+			std::vector<lanms::Polygon> polys_a, polys_b;
+			std::vector<lanms::BoundingBox> boxes_a, boxes_b;
+			for (size_t i = 0; i < n; i ++) {
+				polys_a.emplace_back(lanms::poly_from_n9(aptr + i * 9, precision));
+				boxes_a.emplace_back(lanms::bounding_box(polys_a.back()));
+			}
+			for (size_t j = 0; j < m; j ++) {
+				polys_b.emplace_back(lanms::poly_from_n9(bptr + j * 9, precision));
+				boxes_b.emplace_back(lanms::bounding_box(polys_b.back()));
+			}
+			for (size_t i = 0; i < n; i ++)
+				for (size_t j = 0; j < m; j ++)
+					ptr[i * m + j] = boxes_a[i].overlaps(boxes_b[j]) ? lanms::poly_iou(polys_a[i], polys_b[j]) : 0;
+		}
+		return ret;
+	}
+
+
+	/**
+	 *
+	 * \param quad_n9s a list of n_i-by-9 numpy arrays, one per image
+	 * \param iou_threshold two quadrangles with iou score above this threshold
+	 *		will be merged
+	 * \param precision coordinates are multiplied by this factor before being
+	 *		rounded to the integer grid used by clipper
+	 * \param nb_threads number of threads running the nms, all hardware
+	 *		threads are used when it is not positive
+	 *
+	 * \return a list of n-by-9 numpy arrays, the merged quadrangles of every
+	 *		image
+	 */
+	std::vector<py::array_t<float>> merge_quadrangle_n9_batch(
+			std::vector<py::array_t<float, py::array::c_style | py::array::forcecast>> quad_n9s,
+			float iou_threshold,
+			float precision,
+			int nb_threads) {
+		size_t nb_images = quad_n9s.size();
+		std::vector<const float *> ptrs(nb_images);
+		std::vector<size_t> sizes(nb_images);
+		for (size_t i = 0; i < nb_images; i ++) {
+			auto pbuf = quad_n9s[i].request();
+			if (pbuf.ndim != 2 || pbuf.shape[1] != 9)
+				throw std::runtime_error("quadrangles must have a shape of (n, 9)");
+			ptrs[i] = static_cast<float *>(pbuf.ptr);
+			sizes[i] = pbuf.shape[0];
+		}
+
+		std::vector<std::vector<lanms::Polygon>> results(nb_images);
+		{
+			py::gil_scoped_release release;
+
+			if (nb_threads <= 0)
+				nb_threads = std::max(1u, std::thread::hardware_concurrency());
+			nb_threads = std::max<int>(1, std::min<size_t>(nb_threads, nb_images));
+
+			// images are handed out one at a time, so a few crowded pages do
+			// not leave the other threads idle
+			std::atomic<size_t> next(0);
+			std::exception_ptr error;
+			std::mutex error_mutex;
+			auto worker = [&]() {
+				try {
+					for (size_t i = next ++; i < nb_images; i = next ++)
+						results[i] = lanms::merge_quadrangle_n9(ptrs[i], sizes[i], iou_threshold, precision);
+				} catch (...) {
+					std::lock_guard<std::mutex> lock(error_mutex);
+					if (!error)
+						error = std::current_exception();
+				}
+			};
+
+			std::vector<std::thread> threads;
+			for (int t = 1; t < nb_threads; t ++)
+				threads.emplace_back(worker);
+			worker();
+			for (auto &thread: threads)
+				thread.join();
+
+			if (error)
+				std::rethrow_exception(error);
+		}
+
+		std::vector<py::array_t<float>> ret;
+		for (size_t i = 0; i < nb_images; i ++)
+			ret.emplace_back(polys2array(results[i], precision));
+		return ret;
 	}
 
 }
@@ -55,6 +217,14 @@ PYBIND11_PLUGIN(adaptor) {
 
 	m.def("merge_quadrangle_n9", &lanms_adaptor::merge_quadrangle_n9,
 			"merge quadrangels");
+	m.def("standard_nms", &lanms_adaptor::standard_nms,
+			"standard nms of quadrangels");
+	m.def("merge_quadrangle_n9_batch", &lanms_adaptor::merge_quadrangle_n9_batch,
+			"merge quadrangels of several images in parallel");
+	m.def("iou_matrix", &lanms_adaptor::iou_matrix,
+			"iou of every pair of quadrangels");
+	// checked by __init__.py against ADAPTOR_VERSION, bump both when the functions change
+	m.attr("VERSION") = py::int_(2);
 
 	return m.ptr();
 }
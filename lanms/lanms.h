@@ -1,5 +1,9 @@
 #pragma once
 
+#include <algorithm>
+#include <cmath>
+#include <numeric>
+
 #include "clipper/clipper.hpp"
 
 // locality-aware NMS
@@ -167,9 +171,9 @@ namespace lanms {
 
 
 	/**
-	 * The standard NMS algorithm.
+	 * The standard NMS algorithm, checking every pair of polygons.
 	 */
-	std::vector<Polygon> standard_nms(std::vector<Polygon> &polys, float iou_threshold) {
+	std::vector<Polygon> standard_nms_naive(std::vector<Polygon> &polys, float iou_threshold) {
 		size_t n = polys.size();
 		if (n == 0)
 			return {};
@@ -196,23 +200,133 @@ namespace lanms {
 		return ret;
 	}
 
-	std::vector<Polygon>
-		merge_quadrangle_n9(const float *data, size_t n, float iou_threshold) {
-			using cInt = cl::cInt;
+	struct BoundingBox {
+		cl::cInt x0, y0, x1, y1;
+
+		bool overlaps(const BoundingBox &o) const {
+			return x0 <= o.x1 && o.x0 <= x1 && y0 <= o.y1 && o.y0 <= y1;
+		}
+	};
+
+	BoundingBox bounding_box(const Polygon &p) {
+		BoundingBox b{p.poly[0].X, p.poly[0].Y, p.poly[0].X, p.poly[0].Y};
+		for (auto &&pt: p.poly) {
+			b.x0 = std::min(b.x0, pt.X);
+			b.y0 = std::min(b.y0, pt.Y);
+			b.x1 = std::max(b.x1, pt.X);
+			b.y1 = std::max(b.y1, pt.Y);
+		}
+		return b;
+	}
 
+	/**
+	 * The standard NMS algorithm.
+	 *
+	 * Polygons are bucketed on a uniform grid by their axis-aligned bounding
+	 * boxes, so the polygon iou is only computed for pairs whose bounding boxes
+	 * overlap. Two polygons whose bounding boxes do not overlap have an iou of
+	 * zero, so the result is the same as standard_nms_naive.
+	 */
+	std::vector<Polygon> standard_nms(std::vector<Polygon> &polys, float iou_threshold) {
+		size_t n = polys.size();
+		if (n == 0)
+			return {};
+		if (iou_threshold < 0)
+			// every pair has to be merged, the index does not help
+			return standard_nms_naive(polys, iou_threshold);
+
+		std::vector<size_t> indices(n);
+		std::iota(std::begin(indices), std::end(indices), 0);
+		std::sort(std::begin(indices), std::end(indices), [&](size_t i, size_t j) { return polys[i].score > polys[j].score; });
+
+		// rank of every polygon in the score order, only lower ranked
+		// polygons can be suppressed by a kept one
+		std::vector<size_t> rank(n);
+		for (size_t i = 0; i < n; i ++)
+			rank[indices[i]] = i;
+
+		std::vector<BoundingBox> boxes(n);
+		BoundingBox extent = bounding_box(polys[0]);
+		double mean_side = 0;
+		for (size_t i = 0; i < n; i ++) {
+			auto &b = boxes[i] = bounding_box(polys[i]);
+			extent.x0 = std::min(extent.x0, b.x0);
+			extent.y0 = std::min(extent.y0, b.y0);
+			extent.x1 = std::max(extent.x1, b.x1);
+			extent.y1 = std::max(extent.y1, b.y1);
+			mean_side += std::max(b.x1 - b.x0, b.y1 - b.y0);
+		}
+		mean_side /= n;
+
+		// cells about the size of an average polygon, but no more cells than
+		// polygons so that sparse pages do not allocate huge grids
+		double width = double(extent.x1 - extent.x0) + 1, height = double(extent.y1 - extent.y0) + 1;
+		double cell = std::max({mean_side, 1.0, std::sqrt(width * height / n)});
+		auto nx = size_t(width / cell) + 1, ny = size_t(height / cell) + 1;
+		auto cell_x = [&](cl::cInt x) { return std::min(size_t((x - extent.x0) / cell), nx - 1); };
+		auto cell_y = [&](cl::cInt y) { return std::min(size_t((y - extent.y0) / cell), ny - 1); };
+
+		std::vector<std::vector<size_t>> grid(nx * ny);
+		for (size_t i = 0; i < n; i ++) {
+			auto &b = boxes[i];
+			for (size_t cy = cell_y(b.y0); cy <= cell_y(b.y1); cy ++)
+				for (size_t cx = cell_x(b.x0); cx <= cell_x(b.x1); cx ++)
+					grid[cy * nx + cx].emplace_back(i);
+		}
+
+		// a polygon spanning several cells is seen once per cell, visited
+		// records the last kept polygon that checked it
+		std::vector<bool> suppressed(n, false);
+		std::vector<size_t> visited(n, n);
+
+		std::vector<size_t> keep;
+		for (auto &&cur: indices) {
+			if (suppressed[cur])
+				continue;
+			keep.emplace_back(cur);
+			auto &b = boxes[cur];
+			for (size_t cy = cell_y(b.y0); cy <= cell_y(b.y1); cy ++) {
+				for (size_t cx = cell_x(b.x0); cx <= cell_x(b.x1); cx ++) {
+					for (auto &&i: grid[cy * nx + cx]) {
+						if (rank[i] <= rank[cur] || suppressed[i] || visited[i] == cur)
+							continue;
+						visited[i] = cur;
+						if (b.overlaps(boxes[i]) && should_merge(polys[cur], polys[i], iou_threshold))
+							suppressed[i] = true;
+					}
+				}
+			}
+		}
+
+		std::vector<Polygon> ret;
+		for (auto &&i: keep) {
+			ret.emplace_back(polys[i]);
+		}
+		return ret;
+	}
+
+	/**
+	 * Build a polygon from 8 coordinates followed by a score.
+	 */
+	Polygon poly_from_n9(const float *p, float precision = 1) {
+		using cInt = cl::cInt;
+		return Polygon{
+			{
+				{cInt(p[0] * precision), cInt(p[1] * precision)},
+				{cInt(p[2] * precision), cInt(p[3] * precision)},
+				{cInt(p[4] * precision), cInt(p[5] * precision)},
+				{cInt(p[6] * precision), cInt(p[7] * precision)},
+			},
+			p[8],
+		};
+	}
+
+	std::vector<Polygon>
+		merge_quadrangle_n9(const float *data, size_t n, float iou_threshold, float precision = 1) {
 			// first pass
 			std::vector<Polygon> polys;
 			for (size_t i = 0; i < n; i ++) {
-				auto p = data + i * 9;
-				Polygon poly{
-					{
-						{cInt(p[0]), cInt(p[1])},
-						{cInt(p[2]), cInt(p[3])},
-						{cInt(p[4]), cInt(p[5])},
-						{cInt(p[6]), cInt(p[7])},
-					},
-					p[8],
-				};
+				auto poly = poly_from_n9(data + i * 9, precision);
 
 				if (polys.size()) {
 					// merge with the last one
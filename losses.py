@@ -1,37 +1,38 @@
 import tensorflow as tf
 
 
-def dice_loss(overly_small_text_region_training_mask, text_region_boundary_training_mask, loss_weight,
-              small_text_weight):
+def training_mask(overly_small_text_region_training_mask, text_region_boundary_training_mask, small_text_weight):
+    # weight of every pixel in both losses, built once and passed to dice_loss and rbox_loss
+    return tf.minimum(overly_small_text_region_training_mask + small_text_weight,
+                      1) * text_region_boundary_training_mask
+
+
+def dice_loss(training_mask, loss_weight):
     def loss(y_true, y_pred):
         eps = 1e-5
-        _training_mask = tf.minimum(overly_small_text_region_training_mask + small_text_weight,
-                                    1) * text_region_boundary_training_mask
-        intersection = tf.reduce_sum(y_true * y_pred * _training_mask)
-        union = tf.reduce_sum(y_true * _training_mask) + tf.reduce_sum(y_pred * _training_mask) + eps
+        intersection = tf.reduce_sum(y_true * y_pred * training_mask)
+        union = tf.reduce_sum(y_true * training_mask) + tf.reduce_sum(y_pred * training_mask) + eps
         loss = 1. - (2. * intersection / union)
         return loss * loss_weight
 
     return loss
 
 
-def rbox_loss(overly_small_text_region_training_mask, text_region_boundary_training_mask, small_text_weight,
-              target_score_map):
+def rbox_loss(training_mask, target_score_map):
     def loss(y_true, y_pred):
-        # d1:top, d2:right, d3:bottom, d4:left
-        d1_gt, d2_gt, d3_gt, d4_gt, theta_gt = tf.split(value=y_true, num_or_size_splits=5, axis=3)
-        d1_pred, d2_pred, d3_pred, d4_pred, theta_pred = tf.split(value=y_pred, num_or_size_splits=5, axis=3)
-        area_gt = (d1_gt + d3_gt) * (d2_gt + d4_gt)
-        area_pred = (d1_pred + d3_pred) * (d2_pred + d4_pred)
-        w_union = tf.minimum(d2_gt, d2_pred) + tf.minimum(d4_gt, d4_pred)
-        h_union = tf.minimum(d1_gt, d1_pred) + tf.minimum(d3_gt, d3_pred)
+        # distances d1:top, d2:right, d3:bottom, d4:left in the first 4 channels, the angle in the last one
+        # the minimum of the distances is taken on all 4 channels at once instead of splitting both maps
+        d_gt, d_pred = y_true[:, :, :, :4], y_pred[:, :, :, :4]
+        d_min = tf.minimum(d_gt, d_pred)
+        area_gt = (d_gt[:, :, :, 0:1] + d_gt[:, :, :, 2:3]) * (d_gt[:, :, :, 1:2] + d_gt[:, :, :, 3:4])
+        area_pred = (d_pred[:, :, :, 0:1] + d_pred[:, :, :, 2:3]) * (d_pred[:, :, :, 1:2] + d_pred[:, :, :, 3:4])
+        w_union = d_min[:, :, :, 1:2] + d_min[:, :, :, 3:4]
+        h_union = d_min[:, :, :, 0:1] + d_min[:, :, :, 2:3]
         area_intersect = w_union * h_union
         area_union = area_gt + area_pred - area_intersect
         L_AABB = -tf.log((area_intersect + 1.0) / (area_union + 1.0))
-        L_theta = 1 - tf.cos(theta_pred - theta_gt)
+        L_theta = 1 - tf.cos(y_pred[:, :, :, 4:5] - y_true[:, :, :, 4:5])
         L_g = L_AABB + 20 * L_theta
-        _training_mask = tf.minimum(overly_small_text_region_training_mask + small_text_weight,
-                                    1) * text_region_boundary_training_mask
-        return tf.reduce_mean(L_g * target_score_map * _training_mask)
+        return tf.reduce_mean(L_g * target_score_map * training_mask)
 
     return loss
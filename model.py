@@ -1,6 +1,9 @@
+import os
+
 import numpy as np
 
 import tensorflow as tf
+from tensorflow.core.protobuf import rewriter_config_pb2
 import keras.backend as K
 from keras import regularizers
 
@@ -24,15 +27,33 @@ def resize_output_shape(input_shape):
     return tuple(shape)
 
 
+def set_training_session(xla=False, mixed_precision=False):
+    # session of the keras backend for training, set before the model is built
+    # param xla: compiles clusters of ops into fused kernels, on CPU too
+    # param mixed_precision: runs convolutions and matmuls in float16 while the weights stay float32, tensorflow only
+    # rewrites the graph on GPUs with float16 support, the optimizer has to scale the loss, see AdamW
+    config = tf.ConfigProto(allow_soft_placement=True)
+    if xla:
+        config.graph_options.optimizer_options.global_jit_level = tf.OptimizerOptions.ON_1
+        # the global jit level only applies to GPUs unless this is set before the first graph is compiled
+        xla_flags = os.environ.get('TF_XLA_FLAGS', '')
+        if '--tf_xla_cpu_global_jit' not in xla_flags:
+            os.environ['TF_XLA_FLAGS'] = (xla_flags + ' --tf_xla_cpu_global_jit').strip()
+    if mixed_precision:
+        config.graph_options.rewrite_options.auto_mixed_precision = rewriter_config_pb2.RewriterConfig.ON
+    K.set_session(tf.Session(config=config))
+
+
 class EastModel:
 
-    def __init__(self, input_size=512):
+    def __init__(self, input_size=512, backbone_weights='imagenet'):
+        # param backbone_weights: weights of the resnet, None for a random initialization
         input_image = Input(shape=(None, None, 3), name='input_image')
         overly_small_text_region_training_mask = Input(shape=(None, None, 1),
                                                        name='overly_small_text_region_training_mask')
         text_region_boundary_training_mask = Input(shape=(None, None, 1), name='text_region_boundary_training_mask')
         target_score_map = Input(shape=(None, None, 1), name='target_score_map')
-        resnet = ResNet50(input_tensor=input_image, weights='imagenet', include_top=False, pooling=None)
+        resnet = ResNet50(input_tensor=input_image, weights=backbone_weights, include_top=False, pooling=None)
         x = resnet.get_layer('activation_49').output
 
         x = Lambda(resize_bilinear, name='resize_1')(x)
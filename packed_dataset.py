@@ -0,0 +1,117 @@
+import os
+import json
+import struct
+import argparse
+
+import cv2
+import numpy as np
+
+from data_processor import get_image_paths, load_annotation
+
+# file layout: header, the samples one after the other, json index
+# header: magic, offset and length of the index
+MAGIC = b'EASTPACK'
+HEADER = struct.Struct('<8sQQ')
+ALIGNMENT = 16
+
+
+class PackedDataset:
+    # read only view of a file written by pack, the samples are read through a memory map
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            magic, index_offset, index_length = HEADER.unpack(f.read(HEADER.size))
+            if magic != MAGIC:
+                raise ValueError('Not a packed dataset: {}'.format(path))
+            f.seek(index_offset)
+            index = json.loads(f.read(index_length).decode('utf-8'))
+        self.names = [entry['name'] for entry in index]
+        self.entries = {entry['name']: entry for entry in index}
+        self._data = None
+
+    @property
+    def data(self):
+        # opened lazily so that every worker process maps the file itself
+        if self._data is None:
+            self._data = np.memmap(self.path, dtype=np.uint8, mode='r')
+        return self._data
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_data'] = None
+        return state
+
+    def __len__(self):
+        return len(self.names)
+
+    def load(self, name):
+        # decoded image, polygons and tags of a sample, same as cv2.imread and load_annotation
+        entry = self.entries[name]
+
+        offset, size = entry['image_offset'], entry['image_size']
+        if entry['encoding'] == 'png':
+            image = cv2.imdecode(self.data[offset:offset + size], cv2.IMREAD_COLOR)
+        else:
+            image = np.array(self.data[offset:offset + size]).reshape(entry['shape'])
+
+        offset, count = entry['polys_offset'], entry['nb_polys']
+        text_polys = np.array(self.data[offset:offset + count * 32].view(np.float32)).reshape((count, 4, 2))
+        offset = entry['tags_offset']
+        text_tags = np.array(self.data[offset:offset + count], dtype=np.bool)
+        return image, text_polys, text_tags
+
+
+def pack(data_path, output_path, compress=False):
+    # writes every annotated image of data_path into a single file
+    # param compress: store the pixels as png instead of raw decoded pixels
+
+    def write_aligned(f, buffer):
+        f.write(b'\0' * (-f.tell() % ALIGNMENT))
+        offset = f.tell()
+        f.write(buffer)
+        return offset
+
+    index = []
+    with open(output_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, 0, 0))
+        for image_path in sorted(get_image_paths(data_path)):
+            text_polys, text_tags = load_annotation(image_path)
+            if text_polys is None:
+                continue
+            image = cv2.imread(image_path)
+            if image is None:
+                continue
+            print(image_path)
+
+            pixels = cv2.imencode('.png', image)[1] if compress else image
+            pixels = np.ascontiguousarray(pixels).tobytes()
+            index.append({
+                'name': os.path.basename(image_path),
+                'encoding': 'png' if compress else 'raw',
+                'shape': list(image.shape),
+                'image_offset': write_aligned(f, pixels),
+                'image_size': len(pixels),
+                'nb_polys': int(text_polys.shape[0]),
+                'polys_offset': write_aligned(f, text_polys.astype(np.float32).tobytes()),
+                'tags_offset': write_aligned(f, text_tags.astype(np.uint8).tobytes()),
+            })
+
+        index = json.dumps(index).encode('utf-8')
+        index_offset = write_aligned(f, index)
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, index_offset, len(index)))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--data_path', type=str, default='../funsd_parsed/train_data')
+    parser.add_argument('--output_path', type=str, default='../funsd_parsed/train_data.pack')
+    parser.add_argument('--compress', action='store_true')
+    FLAGS = parser.parse_args()
+
+    pack(FLAGS.data_path, FLAGS.output_path, compress=FLAGS.compress)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+import time
+import queue
+import threading
+
+# marks the end of the stream in the queues
+END = object()
+
+
+class Stage:
+    # nb_workers threads applying fn to the items of input_queue and putting the results in output_queue
+    # fn returns the item for the next stage, or None to drop it
+    # when batched fn takes a list of up to batch_size items already waiting in the queue and returns a list,
+    # batched defaults to batch_size > 1 but a batched fn keeps taking lists with a batch_size of 1
+
+    def __init__(self, name, fn, nb_workers=1, batch_size=1, batched=None):
+        self.name = name
+        self.fn = fn
+        self.nb_workers = nb_workers
+        self.batch_size = batch_size
+        self.batched = batch_size > 1 if batched is None else batched
+
+        self.nb_items = 0
+        self.busy_time = 0.
+        self.lock = threading.Lock()
+        self.nb_running = nb_workers
+
+    def next_items(self, input_queue):
+        item = input_queue.get()
+        if item is END:
+            return None
+        items = [item]
+        while len(items) < self.batch_size:
+            try:
+                item = input_queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is END:
+                # leave the end marker for the other workers
+                input_queue.put(END)
+                break
+            items.append(item)
+        return items
+
+    def work(self, input_queue, output_queue):
+        while True:
+            items = self.next_items(input_queue)
+            if items is None:
+                input_queue.put(END)
+                break
+
+            start = time.perf_counter()
+            try:
+                results = self.fn(items) if self.batched else [self.fn(items[0])]
+            except Exception as e:
+                print('{}: {}'.format(self.name, str(e)))
+                results = []
+            with self.lock:
+                self.busy_time += time.perf_counter() - start
+                self.nb_items += len(items)
+
+            for result in results:
+                if result is not None and output_queue is not None:
+                    output_queue.put(result)
+
+        with self.lock:
+            self.nb_running -= 1
+            last = self.nb_running == 0
+        if last and output_queue is not None:
+            output_queue.put(END)
+
+    def throughput(self):
+        # items per second of the stage when all its workers are busy
+        return self.nb_items * self.nb_workers / self.busy_time if self.busy_time > 0 else float('inf')
+
+
+def run_pipeline(items, stages, queue_size=16):
+    # streams items through the stages, every stage reads from a bounded queue filled by the previous one
+    # returns the stages with their counters
+    queues = [queue.Queue(maxsize=queue_size) for _ in stages]
+    threads = []
+    for i, stage in enumerate(stages):
+        output_queue = queues[i + 1] if i + 1 < len(stages) else None
+        for _ in range(stage.nb_workers):
+            thread = threading.Thread(target=stage.work, args=(queues[i], output_queue), daemon=True)
+            thread.start()
+            threads.append(thread)
+
+    start = time.perf_counter()
+    for item in items:
+        queues[0].put(item)
+    queues[0].put(END)
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    for stage in stages:
+        print('{}: {} items, {:.1f}s busy on {} workers, {:.1f} items/s'.format(
+            stage.name, stage.nb_items, stage.busy_time, stage.nb_workers, stage.throughput()))
+    slowest = min(stages, key=lambda stage: stage.throughput())
+    print('total: {:.1f}s, slowest stage: {}'.format(elapsed, slowest.name))
+    return stages
@@ -1,6 +1,8 @@
 import os
+import inspect
 import logging
 import argparse
+import threading
 
 import cv2
 import numpy as np
@@ -9,17 +11,55 @@ import tensorflow as tf
 from keras.models import model_from_json
 
 import lanms
-from data_processor import get_image_paths, restore_rectangle
+from data_processor import restore_rectangle_rbox_into, normalize_image
+from pipeline import Stage, run_pipeline
 from model import RESIZE_FACTOR
+from export_model import INPUT_NAME, SCORE_MAP_NAME, GEO_MAP_NAME
+from inference_stats import InferenceStats, NULL_STATS, enable_logging
+from checkpoint import Checkpoint, pending_image_paths
+from result_cache import ResultCache, bytes_digest, file_digest, result_key
 
 parser = argparse.ArgumentParser()
 parser.add_argument('--test_data_path', type=str, default='../../funsd_parsed/test_data')
 parser.add_argument('--model_path', type=str, default='models/east/model-funsd400.h5')
+# keras runs .h5 weights or a frozen graph from export_model.py, tflite a quantized model from quantize_model.py
+parser.add_argument('--backend', type=str, default='keras', choices=['keras', 'tflite'])
 parser.add_argument('--output_dir', type=str, default='out/')
-FLAGS = parser.parse_args()
+parser.add_argument('--batch_size', type=int, default=8)
+parser.add_argument('--decode_workers', type=int, default=4)
+parser.add_argument('--postprocess_workers', type=int, default=4)
+parser.add_argument('--writer_workers', type=int, default=2)
+parser.add_argument('--queue_size', type=int, default=16)
+# pages are processed at full resolution in overlapping tiles of this size when > 0, see process_image_tiled
+parser.add_argument('--tile_size', type=int, default=0)
+parser.add_argument('--tile_overlap', type=int, default=256)
+# logs the stage durations and box counts of every image as json lines to this file, or stderr with '-'
+parser.add_argument('--stats_log', type=str, default='')
+# images are searched in the subdirectories of test_data_path too, their results go to the same subdirectories of
+# output_dir
+parser.add_argument('--no_recursive', action='store_true')
+# relative paths of the images whose results are written are appended to this file, a restarted run skips them
+parser.add_argument('--checkpoint_path', type=str, default='')
+# the images are split by a hash of their path between nb_shards processes started with shard 0 to nb_shards - 1,
+# every shard keeps its own checkpoint file, the checkpoint_path with a .shard-<shard>-of-<nb_shards> suffix
+parser.add_argument('--nb_shards', type=int, default=1)
+parser.add_argument('--shard', type=int, default=0)
+# boxes of images already processed with the same weights and settings are read from this directory when set
+parser.add_argument('--cache_dir', type=str, default='')
+# megabytes the cache may take, the least recently used results are removed beyond
+parser.add_argument('--cache_size', type=int, default=1024)
+# parsed when predict.py runs as a script, so that other scripts can import it
+FLAGS = None
+
+
+def load_model(model_path, backend='keras'):
+    # a frozen graph written by export_model.py, or keras weights with the model.json written by train.py next to them
+    # param backend: 'tflite' for a model written by quantize_model.py
+    if backend == 'tflite':
+        return TFLiteModel(model_path)
+    if model_path.endswith('.pb'):
+        return FrozenModel(model_path)
 
-
-def load_model(model_path):
     json_path = '/'.join(model_path.split('/')[0:-1])
     file = open(os.path.join(json_path, 'model.json'), 'r')
     model_json = file.read()
@@ -30,12 +70,113 @@ def load_model(model_path):
     return model
 
 
+class FrozenModel:
+    # inference only graph written by export_model.py, predict takes and returns the same arrays as the keras model
+
+    def __init__(self, model_path):
+        graph_def = tf.GraphDef()
+        with tf.gfile.GFile(model_path, 'rb') as f:
+            graph_def.ParseFromString(f.read())
+
+        self.graph = tf.Graph()
+        with self.graph.as_default():
+            tf.import_graph_def(graph_def, name='')
+        self.session = tf.Session(graph=self.graph)
+        self.input_image = self.graph.get_tensor_by_name(INPUT_NAME + ':0')
+        self.score_map = self.graph.get_tensor_by_name(SCORE_MAP_NAME + ':0')
+        self.geo_map = self.graph.get_tensor_by_name(GEO_MAP_NAME + ':0')
+
+    def predict(self, images, batch_size=None):
+        return self.session.run([self.score_map, self.geo_map], feed_dict={self.input_image: images})
+
+
+class TFLiteModel:
+    # reduced precision model written by quantize_model.py, run by the tflite interpreter
+    # its input size is fixed at conversion, pages are run in tiles of input_size, see process_image_tiled
+
+    def __init__(self, model_path):
+        self.interpreter = tf.lite.Interpreter(model_path=model_path)
+        self.interpreter.allocate_tensors()
+        # the interpreter holds the buffers of a single inference
+        self.lock = threading.Lock()
+
+        self.input_index = self.interpreter.get_input_details()[0]['index']
+        self.input_size = int(self.interpreter.get_input_details()[0]['shape'][1])
+        outputs = {output['name']: output['index'] for output in self.interpreter.get_output_details()}
+        self.score_map_index = outputs[SCORE_MAP_NAME]
+        self.geo_map_index = outputs[GEO_MAP_NAME]
+
+    def predict(self, images, batch_size=None):
+        if images.shape[1:] != (self.input_size, self.input_size, 3):
+            raise ValueError('The model takes {0}x{0} images, got {1}x{2}'.format(self.input_size, *images.shape[1:3]))
+
+        score_maps, geo_maps = [], []
+        with self.lock:
+            for image in images:
+                self.interpreter.set_tensor(self.input_index, image[np.newaxis])
+                self.interpreter.invoke()
+                score_maps.append(self.interpreter.get_tensor(self.score_map_index))
+                geo_maps.append(self.interpreter.get_tensor(self.geo_map_index))
+        return np.concatenate(score_maps), np.concatenate(geo_maps)
+
+
+def model_files(model_path, backend='keras'):
+    # the files load_model reads, their contents identify the weights in the result cache keys
+    if backend == 'tflite' or model_path.endswith('.pb'):
+        return [model_path]
+    return [model_path, os.path.join('/'.join(model_path.split('/')[0:-1]), 'model.json')]
+
+
+def detection_config(tile_size=0, tile_overlap=0):
+    # settings the boxes of an image depend on besides the image and the weights, part of the result cache keys
+    # the thresholds of detect and the max side of resize_image are their defaults, used by process_image
+    config = {'tile_size': tile_size, 'tile_overlap': tile_overlap}
+    for fn in [detect, resize_image]:
+        for name, parameter in inspect.signature(fn).parameters.items():
+            if parameter.default is not inspect.Parameter.empty and name != 'stats':
+                config[name] = parameter.default
+    return config
+
+
+def effective_tile_size(model, flags):
+    # a tflite model only takes inputs of the size it was converted with
+    return model.input_size if flags.backend == 'tflite' else flags.tile_size
+
+
+def open_result_cache(flags, tile_size):
+    # the cache of --cache_dir and the function giving the cache key of the encoded bytes of an image, or None, None
+    if not flags.cache_dir:
+        return None, None
+    cache = ResultCache(flags.cache_dir, flags.cache_size << 20)
+    model_digest = file_digest(*model_files(flags.model_path, flags.backend))
+    config = detection_config(tile_size, flags.tile_overlap if tile_size > 0 else 0)
+    return cache, lambda data: result_key(bytes_digest(data), model_digest, config)
+
+
+def new_stats(flags, cache=None, checkpoint=None, metrics=False):
+    # NULL_STATS when nothing reads the stats, the cache and the checkpoint need them to tell a failed detection from
+    # an image without text
+    if flags.stats_log or metrics or cache is not None or checkpoint is not None:
+        return InferenceStats()
+    return NULL_STATS
+
+
 def resize_image(im, max_side_len=2400):
     # resize image to a size multiple of 32 which is required by the network
     # max_side_len: limit of max image size to avoid out of memory in gpu
 
     h, w, _ = im.shape
+    resize_h, resize_w = resized_shape(h, w, max_side_len)
+    im = cv2.resize(im, (int(resize_w), int(resize_h)))
+
+    ratio_h = resize_h / float(h)
+    ratio_w = resize_w / float(w)
 
+    return im, (ratio_h, ratio_w)
+
+
+def resized_shape(h, w, max_side_len=2400):
+    # height and width of an h x w image after resize_image
     resize_w = w
     resize_h = h
 
@@ -49,53 +190,118 @@ def resize_image(im, max_side_len=2400):
 
     resize_h = resize_h if resize_h % 32 == 0 else (resize_h // 32) * 32
     resize_w = resize_w if resize_w % 32 == 0 else (resize_w // 32) * 32
-    im = cv2.resize(im, (int(resize_w), int(resize_h)))
+    return resize_h, resize_w
 
-    ratio_h = resize_h / float(h)
-    ratio_w = resize_w / float(w)
 
-    return im, (ratio_h, ratio_w)
+def bucket_shape(h, w, bucket_size=128):
+    # size a resized image is padded to in the batches of process_images
+    return -(-h // bucket_size) * bucket_size, -(-w // bucket_size) * bucket_size
+
 
+def batch_pixels(img, bucket_size=128):
+    # pixels an image takes in a forward pass of process_images, after resize_image and the padding to its bucket
+    h, w, _ = img.shape
+    bucket_h, bucket_w = bucket_shape(*resized_shape(h, w), bucket_size=bucket_size)
+    return bucket_h * bucket_w
 
-def detect(score_map, geo_map, score_map_thresh=0.8, box_thresh=0.1, nms_thres=0.2):
+
+def detect(score_map, geo_map, score_map_thresh=0.8, box_thresh=0.1, nms_thres=0.2, stats=None):
     # restore text boxes from score map and geo map
     # param score_map:
     # param geo_map:
     # param score_map_thresh: threshhold for score map
     # param box_thresh: threshhold for boxes
     # param nms_thres: threshold for nms
+    # param stats: InferenceStats receiving the durations of the steps and the number of boxes after each of them
 
+    stats = stats or NULL_STATS
     if len(score_map.shape) == 4:
         score_map = score_map[0, :, :, 0]
         geo_map = geo_map[0, :, :, ]
 
-    # filter the score map
-    xy_text = np.argwhere(score_map > score_map_thresh)
+    with stats.stage('restore'):
+        boxes = restore_candidates(score_map, geo_map, score_map_thresh)
+    stats.count('candidates', len(boxes))
+
+    # nms part
+    with stats.stage('nms'):
+        boxes = lanms.merge_quadrangle_n9(boxes, nms_thres)
+    stats.count('after_nms', len(boxes))
 
-    # sort the text boxes via the y axis
-    xy_text = xy_text[np.argsort(xy_text[:, 0])]
+    with stats.stage('rescore'):
+        boxes = filter_boxes(score_map, boxes, box_thresh)
+    stats.count('after_rescore', len(boxes) if boxes is not None else 0)
+    return boxes
 
-    # restore
-    text_box_restored = restore_rectangle(xy_text[:, ::-1] * 4, geo_map[xy_text[:, 0], xy_text[:, 1], :])
-    boxes = np.zeros((text_box_restored.shape[0], 9), dtype=np.float32)
-    boxes[:, :8] = text_box_restored.reshape((-1, 8))
-    boxes[:, 8] = score_map[xy_text[:, 0], xy_text[:, 1]]
+
+def detect_batch(score_maps, geo_maps, score_map_thresh=0.8, box_thresh=0.1, nms_thres=0.2, nb_threads=0,
+                 stats=None):
+    # detect for a list of 2d score maps and 3d geo maps, one per image
+    # the nms of all the images runs in parallel on nb_threads threads, all cores when nb_threads <= 0
+    # param stats: InferenceStats receiving the totals over the images
+
+    stats = stats or NULL_STATS
+    with stats.stage('restore'):
+        candidates = [restore_candidates(score_map, geo_map, score_map_thresh)
+                      for score_map, geo_map in zip(score_maps, geo_maps)]
+    stats.count('candidates', sum(len(boxes) for boxes in candidates))
 
     # nms part
-    boxes = lanms.merge_quadrangle_n9(boxes.astype('float32'), nms_thres)
+    with stats.stage('nms'):
+        merged = lanms.merge_quadrangle_n9_batch(candidates, nms_thres, nb_threads=nb_threads)
+    stats.count('after_nms', sum(len(boxes) for boxes in merged))
+
+    with stats.stage('rescore'):
+        filtered = [filter_boxes(score_map, boxes, box_thresh) for score_map, boxes in zip(score_maps, merged)]
+    stats.count('after_rescore', sum(len(boxes) for boxes in filtered if boxes is not None))
+    return filtered
+
+
+def restore_candidates(score_map, geo_map, score_map_thresh):
+    # (n, 9) array of the boxes of every score map pixel above score_map_thresh, before nms
+
+    # filter the score map, the pixels come in row major order so they are already sorted via the y axis
+    ys, xs = np.nonzero(score_map > score_map_thresh)
+
+    # restore
+    boxes = np.empty((len(ys), 9), dtype=np.float32)
+    restore_rectangle_rbox_into(xs * 4, ys * 4, geo_map[ys, xs], boxes)
+    boxes[:, 8] = score_map[ys, xs]
+    return boxes
+
+
+def filter_boxes(score_map, boxes, box_thresh):
+    # re-score the boxes left after nms, returns None when nms left nothing
     if boxes.shape[0] == 0:
         return None
 
     # here we filter some low score boxes by the average score map, this is different from the orginal paper
-    for i, box in enumerate(boxes):
-        mask = np.zeros_like(score_map, dtype=np.uint8)
-        cv2.fillPoly(mask, box[:8].reshape((-1, 4, 2)).astype(np.int32) // 4, 1)
-        boxes[i, 8] = cv2.mean(score_map, mask)[0]
+    boxes[:, 8] = box_mean_scores(score_map, boxes)
 
     boxes = boxes[boxes[:, 8] > box_thresh]
     return boxes
 
 
+def box_mean_scores(score_map, boxes):
+    # average score map value inside every box of an (n, 9) box array
+    # every box is rasterized into a mask covering only its bounding rectangle on the score map instead of a
+    # full size mask, which gives the same values as filling a full size mask for each box
+    h, w = score_map.shape[:2]
+    polys = boxes[:, :8].reshape((-1, 4, 2)).astype(np.int32) // 4
+    mins = np.clip(polys.min(axis=1), 0, [w, h])
+    maxs = np.clip(polys.max(axis=1) + 1, 0, [w, h])
+
+    scores = np.zeros(polys.shape[0], dtype=np.float32)
+    for i, poly in enumerate(polys):
+        (x0, y0), (x1, y1) = mins[i], maxs[i]
+        if x1 <= x0 or y1 <= y0:
+            continue
+        mask = np.zeros((y1 - y0, x1 - x0), dtype=np.uint8)
+        cv2.fillPoly(mask, (poly - [x0, y0])[np.newaxis, :, :], 1)
+        scores[i] = cv2.mean(score_map[y0:y1, x0:x1], mask)[0]
+    return scores
+
+
 def sort_poly(p):
     min_axis = np.argmin(np.sum(p, axis=1))
     p = p[[min_axis, (min_axis + 1) % 4, (min_axis + 2) % 4, (min_axis + 3) % 4]]
@@ -105,54 +311,328 @@ def sort_poly(p):
         return p[[0, 3, 2, 1]]
 
 
-def process_image(model, img):
+def restore_boxes(boxes, ratio_h, ratio_w):
+    # map the boxes returned by detect back to the original image size
+    final_boxes = []
+    if boxes is not None:
+        boxes = boxes[:, :8].reshape((-1, 4, 2))
+        boxes[:, :, 0] /= ratio_w
+        boxes[:, :, 1] /= ratio_h
+
+        for box in boxes:
+            box = sort_poly(box.astype(np.int32))
+            if np.linalg.norm(box[0] - box[1]) < 5 or np.linalg.norm(box[3] - box[0]) < 5:
+                continue
+            final_boxes.append(box)
+    return final_boxes
+
+
+def process_image(model, img, stats=None):
+    # param stats: InferenceStats receiving the durations of the stages, the box counts and the error if any
+    stats = stats or NULL_STATS
     final_boxes = []
     try:
-        img = img[:, :, ::-1]
-        img_resized, (ratio_h, ratio_w) = resize_image(img)
-        img_resized = (img_resized / 127.5) - 1
+        with stats.stage('resize'):
+            img_resized, (ratio_h, ratio_w) = resize_image(img)
 
-        score_map, geo_map = model.predict(img_resized[np.newaxis, :, :, :])
+        with stats.stage('normalize'):
+            batch = normalize_image(img_resized)[np.newaxis, :, :, :]
+
+        with stats.stage('predict'):
+            score_map, geo_map = model.predict(batch)
+
+        boxes = detect(score_map=score_map, geo_map=geo_map, stats=stats)
+        with stats.stage('restore_boxes'):
+            final_boxes = restore_boxes(boxes, ratio_h, ratio_w)
+        stats.count('boxes', len(final_boxes))
+    except Exception as e:
+        print(str(e))
+        stats.fail(e)
+    return final_boxes
 
-        boxes = detect(score_map=score_map, geo_map=geo_map)
-        if boxes is not None:
-            boxes = boxes[:, :8].reshape((-1, 4, 2))
-            boxes[:, :, 0] /= ratio_w
-            boxes[:, :, 1] /= ratio_h
 
-            for box in boxes:
-                box = sort_poly(box.astype(np.int32))
-                if np.linalg.norm(box[0] - box[1]) < 5 or np.linalg.norm(box[3] - box[0]) < 5:
+def process_images(model, imgs, batch_size=8, bucket_size=128, nb_threads=0, stats=None):
+    # batched version of process_image, returns a list of boxes for every image in imgs
+    # resized images are grouped into buckets of bucket_size (a multiple of 32) so that images of similar size
+    # share a forward pass, every image is padded to the size of its bucket
+    # param batch_size: max number of images in a single forward pass
+    # param bucket_size: granularity of the bucket sides
+    # param nb_threads: number of threads running the nms of a batch, all cores when <= 0
+    # param stats: InferenceStats receiving the totals over the images
+
+    assert bucket_size % 32 == 0
+    stats = stats or NULL_STATS
+    final_boxes = [[] for _ in imgs]
+
+    resized = []
+    buckets = {}
+    for idx, img in enumerate(imgs):
+        with stats.stage('resize'):
+            img_resized, ratios = resize_image(img)
+        resized.append((img_resized, ratios))
+
+        h, w, _ = img_resized.shape
+        bucket = bucket_shape(h, w, bucket_size)
+        buckets.setdefault(bucket, []).append(idx)
+
+    for (bucket_h, bucket_w), indices in buckets.items():
+        for start in range(0, len(indices), batch_size):
+            batch_indices = indices[start:start + batch_size]
+            try:
+                score_maps, geo_maps = predict_maps(model, [resized[idx][0] for idx in batch_indices],
+                                                    bucket_h, bucket_w, stats=stats)
+                batch_boxes = detect_batch(score_maps, geo_maps, nb_threads=nb_threads, stats=stats)
+            except Exception as e:
+                print(str(e))
+                stats.fail(e)
+                continue
+
+            with stats.stage('restore_boxes'):
+                for idx, boxes in zip(batch_indices, batch_boxes):
+                    ratio_h, ratio_w = resized[idx][1]
+                    final_boxes[idx] = restore_boxes(boxes, ratio_h, ratio_w)
+                    stats.count('boxes', len(final_boxes[idx]))
+    return final_boxes
+
+
+def process_image_tiled(model, img, tile_size=1024, tile_overlap=256, batch_size=4, nms_thres=0.2, nb_threads=0,
+                        stats=None):
+    # full resolution version of process_image for large scans, the image is split into overlapping tiles of
+    # tile_size x tile_size which are run batch_size at a time, so memory depends on the tile size and not the page
+    # every tile keeps the boxes centered in the part of the page it owns, the boxes of text crossing the middle of an
+    # overlap can come from both tiles and are merged with nms
+    # param tile_overlap: should be at least twice the length of the longest text line expected
+    # param stats: InferenceStats receiving the totals over the tiles
+
+    assert tile_size % 32 == 0 and 0 <= tile_overlap < tile_size
+    stats = stats or NULL_STATS
+    final_boxes = []
+    try:
+        h, w, _ = img.shape
+        tiles = [(y_span, x_span) for y_span in tile_spans(h, tile_size, tile_overlap)
+                 for x_span in tile_spans(w, tile_size, tile_overlap)]
+
+        page_boxes = []
+        for start in range(0, len(tiles), batch_size):
+            batch_tiles = tiles[start:start + batch_size]
+            score_maps, geo_maps = predict_maps(model, [img[y:y + tile_size, x:x + tile_size]
+                                                        for (y, _, _), (x, _, _) in batch_tiles], tile_size, tile_size,
+                                                   stats=stats)
+            batch_boxes = detect_batch(score_maps, geo_maps, nms_thres=nms_thres, nb_threads=nb_threads, stats=stats)
+
+            for ((y, y_min, y_max), (x, x_min, x_max)), boxes in zip(batch_tiles, batch_boxes):
+                if boxes is None:
                     continue
-                final_boxes.append(box)
+                # to page coordinates
+                boxes[:, 0:8:2] += x
+                boxes[:, 1:8:2] += y
+                center_x = boxes[:, 0:8:2].mean(axis=1)
+                center_y = boxes[:, 1:8:2].mean(axis=1)
+                boxes = boxes[(center_x >= x_min) & (center_x < x_max) & (center_y >= y_min) & (center_y < y_max)]
+                if len(boxes) > 0:
+                    page_boxes.append(boxes)
+
+        if len(page_boxes) > 0:
+            with stats.stage('merge_tiles'):
+                boxes = lanms.standard_nms(np.concatenate(page_boxes), nms_thres)
+            with stats.stage('restore_boxes'):
+                final_boxes = restore_boxes(boxes, 1., 1.)
+        stats.count('boxes', len(final_boxes))
     except Exception as e:
         print(str(e))
+        stats.fail(e)
     return final_boxes
 
 
-def main():
-    os.system(f'mkdir -p {FLAGS.output_dir}')
+def tile_spans(length, tile_size, tile_overlap):
+    # (origin, min, max) of the tiles along an axis of the given length, the last tile ends at the border
+    # a tile owns the coordinates in [min, max), neighbouring tiles split their overlap in the middle
+    if length <= tile_size:
+        return [(0, -np.inf, np.inf)]
 
-    model = load_model(model_path=FLAGS.model_path)
+    origins = list(range(0, length - tile_size, tile_size - tile_overlap)) + [length - tile_size]
+    seams = [(origin + tile_size + next_origin) / 2. for origin, next_origin in zip(origins[:-1], origins[1:])]
+    return list(zip(origins, [-np.inf] + seams, seams + [np.inf]))
 
-    image_paths = get_image_paths(FLAGS.test_data_path)
-    for image_path in image_paths:
-        print(image_path)
 
-        img = cv2.imread(image_path)
-        boxes = process_image(model, img)
+def predict_maps(model, imgs_resized, batch_h=None, batch_w=None, stats=None):
+    # one forward pass for a list of resized bgr images, returns the score maps and the geo maps of every image
+    # the images are padded to batch_h x batch_w, by default the largest height and width among them
+
+    stats = stats or NULL_STATS
+    shapes = [img_resized.shape for img_resized in imgs_resized]
+    batch_h = batch_h or max(h for h, _, _ in shapes)
+    batch_w = batch_w or max(w for _, w, _ in shapes)
 
-        res_file = os.path.join(FLAGS.output_dir, '{}.txt'.format(os.path.basename(image_path).split('.')[0]))
-        with open(res_file, 'w') as f:
-            for box in boxes:
-                f.write('{},{},{},{},{},{},{},{}\r\n'.format(box[0, 0], box[0, 1], box[1, 0], box[1, 1], box[2, 0],
-                                                             box[2, 1], box[3, 0], box[3, 1]))
-                cv2.polylines(img, [box.astype(np.int32).reshape((-1, 1, 2))], True,
-                              color=(0, 0, 255), thickness=1)
-        out_image_path = os.path.join(FLAGS.output_dir, os.path.basename(image_path))
-        cv2.imwrite(out_image_path, img)
+    # pad with -1, i.e. black pixels after normalization, same as pad_image does during training
+    with stats.stage('normalize'):
+        batch = np.full((len(imgs_resized), batch_h, batch_w, 3), -1., dtype=np.float32)
+        for i, img_resized in enumerate(imgs_resized):
+            h, w, _ = shapes[i]
+            normalize_image(img_resized, out=batch[i, :h, :w, :])
+
+    with stats.stage('predict'):
+        score_maps, geo_maps = model.predict(batch, batch_size=len(imgs_resized))
+
+    # the maps are a quarter of the input size, crop the padding out of them
+    return [score_maps[i, :h // 4, :w // 4, 0] for i, (h, w, _) in enumerate(shapes)], \
+           [geo_maps[i, :h // 4, :w // 4, :] for i, (h, w, _) in enumerate(shapes)]
+
+
+def write_results(image_path, img, boxes):
+    # the results of an image in a subdirectory of test_data_path go to the same subdirectory of output_dir
+    output_dir = os.path.join(FLAGS.output_dir, os.path.dirname(os.path.relpath(image_path, FLAGS.test_data_path)))
+    os.makedirs(output_dir, exist_ok=True)
+    res_file = os.path.join(output_dir, '{}.txt'.format(os.path.basename(image_path).split('.')[0]))
+    with open(res_file, 'w') as f:
+        for box in boxes:
+            f.write('{},{},{},{},{},{},{},{}\r\n'.format(box[0, 0], box[0, 1], box[1, 0], box[1, 1], box[2, 0],
+                                                         box[2, 1], box[3, 0], box[3, 1]))
+            cv2.polylines(img, [box.astype(np.int32).reshape((-1, 1, 2))], True,
+                          color=(0, 0, 255), thickness=1)
+    out_image_path = os.path.join(output_dir, os.path.basename(image_path))
+    cv2.imwrite(out_image_path, img)
+
+
+def main():
+    os.system(f'mkdir -p {FLAGS.output_dir}')
+
+    model = load_model(model_path=FLAGS.model_path, backend=FLAGS.backend)
+    tile_size = effective_tile_size(model, FLAGS)
+
+    # every item carries the stats of its image, logged once the results are written
+    if FLAGS.stats_log:
+        enable_logging(None if FLAGS.stats_log == '-' else FLAGS.stats_log)
+
+    checkpoint = None
+    if FLAGS.checkpoint_path:
+        checkpoint_path = FLAGS.checkpoint_path
+        if FLAGS.nb_shards > 1:
+            checkpoint_path += '.shard-{}-of-{}'.format(FLAGS.shard, FLAGS.nb_shards)
+        checkpoint = Checkpoint(checkpoint_path)
+        print('Skipping the {} images done in {}'.format(len(checkpoint), checkpoint_path))
+    # listed lazily, the first images are processed while the directories are still scanned
+    image_paths = pending_image_paths(FLAGS.test_data_path, checkpoint, FLAGS.shard, FLAGS.nb_shards,
+                                      recursive=not FLAGS.no_recursive, output_dir=FLAGS.output_dir)
+
+    cache, cache_key = open_result_cache(FLAGS, tile_size)
+    # cache key of every image on its way from read to write
+    cache_keys = {}
+
+    def read(image_path):
+        # returns None for an image found in the cache, its results are written right away and it skips the model
+        print(image_path)
+        stats = new_stats(FLAGS, cache, checkpoint)
+        with stats.stage('read'):
+            if cache is None:
+                img = cv2.imread(image_path)
+            else:
+                data = np.fromfile(image_path, dtype=np.uint8)
+                key = cache_key(data)
+                img = cv2.imdecode(data, cv2.IMREAD_COLOR)
+        if cache is not None:
+            with stats.stage('cache'):
+                boxes = cache.get(key)
+            if boxes is not None:
+                stats.count('cache_hits', 1)
+                write((image_path, img, boxes, stats))
+                return None
+            cache_keys[image_path] = key
+        return image_path, img, stats
+
+    def write(item):
+        image_path, img, boxes, stats = item
+        if cache is not None and image_path in cache_keys:
+            key = cache_keys.pop(image_path)
+            if stats.error is None:
+                with stats.stage('cache'):
+                    cache.put(key, boxes)
+        with stats.stage('write'):
+            write_results(image_path, img, boxes)
+        # a failed image is not recorded as done, a restarted run tries it again
+        if checkpoint is not None and stats.error is None:
+            checkpoint.mark_done(os.path.relpath(image_path, FLAGS.test_data_path))
+        stats.log(image_path=image_path)
+
+    if tile_size > 0:
+        # read -> detect -> write, the tiles of a page make up the batches of the model
+        def detect_tiled(item):
+            image_path, img, stats = item
+            return image_path, img, process_image_tiled(model, img, tile_size, FLAGS.tile_overlap,
+                                                        batch_size=FLAGS.batch_size, stats=stats), stats
+
+        run_pipeline(image_paths, [
+            Stage('read', read, nb_workers=FLAGS.decode_workers),
+            Stage('detect', detect_tiled),
+            Stage('write', write, nb_workers=FLAGS.writer_workers),
+        ], queue_size=FLAGS.queue_size)
+        if cache is not None:
+            print('Result cache: {}'.format(cache.stats()))
+        return
+
+    # decode -> infer -> post-process -> write, every stage runs in its own threads
+    def decode(image_path):
+        item = read(image_path)
+        if item is None:
+            return None
+        image_path, img, stats = item
+        with stats.stage('resize'):
+            img_resized, ratios = resize_image(img)
+        return image_path, img, img_resized, ratios, stats
+
+    def infer(items):
+        # every image is padded to its bucket like in process_images, so that its maps do not depend on the images
+        # it was queued with, the images of a bucket run in one forward pass and share its durations
+        # the images of a failed forward pass get no maps and empty results, like process_image does
+        buckets = {}
+        for idx, (_, _, img_resized, _, _) in enumerate(items):
+            h, w, _ = img_resized.shape
+            buckets.setdefault(bucket_shape(h, w), []).append(idx)
+
+        score_maps, geo_maps = [None] * len(items), [None] * len(items)
+        for (bucket_h, bucket_w), indices in buckets.items():
+            batch_stats = new_stats(FLAGS, cache, checkpoint)
+            try:
+                bucket_score_maps, bucket_geo_maps = predict_maps(model, [items[idx][2] for idx in indices],
+                                                                  bucket_h, bucket_w, stats=batch_stats)
+                for idx, score_map, geo_map in zip(indices, bucket_score_maps, bucket_geo_maps):
+                    score_maps[idx], geo_maps[idx] = score_map, geo_map
+            except Exception as e:
+                print(str(e))
+                for idx in indices:
+                    items[idx][4].fail(e)
+            for idx in indices:
+                items[idx][4].merge(batch_stats)
+        return [(image_path, img, score_map, geo_map, ratios, stats)
+                for (image_path, img, _, ratios, stats), score_map, geo_map in zip(items, score_maps, geo_maps)]
+
+    def postprocess(item):
+        image_path, img, score_map, geo_map, (ratio_h, ratio_w), stats = item
+        final_boxes = []
+        if score_map is not None:
+            try:
+                boxes = detect(score_map=score_map, geo_map=geo_map, stats=stats)
+                with stats.stage('restore_boxes'):
+                    final_boxes = restore_boxes(boxes, ratio_h, ratio_w)
+            except Exception as e:
+                print(str(e))
+                stats.fail(e)
+        stats.count('boxes', len(final_boxes))
+        return image_path, img, final_boxes, stats
+
+    run_pipeline(image_paths, [
+        Stage('decode', decode, nb_workers=FLAGS.decode_workers),
+        Stage('infer', infer, batch_size=FLAGS.batch_size, batched=True),
+        Stage('postprocess', postprocess, nb_workers=FLAGS.postprocess_workers),
+        Stage('write', write, nb_workers=FLAGS.writer_workers),
+    ], queue_size=FLAGS.queue_size)
+    if cache is not None:
+        print('Result cache: {}'.format(cache.stats()))
 
 
 if __name__ == '__main__':
+    FLAGS = parser.parse_args()
+    if not 0 <= FLAGS.shard < FLAGS.nb_shards:
+        parser.error('--shard must be in [0, --nb_shards)')
     logging.getLogger().setLevel(logging.ERROR)
     main()
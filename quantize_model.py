@@ -0,0 +1,126 @@
+import time
+import logging
+import argparse
+
+import cv2
+import numpy as np
+
+import tensorflow as tf
+
+import lanms
+from data_processor import get_image_paths, normalize_image
+from export_model import INPUT_NAME, SCORE_MAP_NAME, GEO_MAP_NAME
+from predict import load_model, process_image_tiled, tile_spans
+
+parser = argparse.ArgumentParser()
+# frozen graph written by export_model.py
+parser.add_argument('--model_path', type=str, default='models/east/model-funsd400.pb')
+parser.add_argument('--output_path', type=str, default='models/east/model-funsd400.tflite')
+parser.add_argument('--calibration_data_path', type=str, default='../../funsd_parsed/val_data')
+parser.add_argument('--nb_calibration_images', type=int, default=100)
+# int8 quantizes weights and activations using the calibration images, float16 only stores the weights as float16
+parser.add_argument('--quantization', type=str, default='int8', choices=['int8', 'float16'])
+# the tflite model takes input_size x input_size images, pages are run in tiles of this size
+parser.add_argument('--input_size', type=int, default=512)
+parser.add_argument('--tile_overlap', type=int, default=128)
+# boxes of the two models with at least this iou are counted as the same detection in the drift report
+parser.add_argument('--iou_threshold', type=float, default=0.5)
+
+
+def calibration_tiles(image_paths, input_size, tile_overlap):
+    # normalized tiles of the calibration images, as the tiled inference feeds them to the model
+    for image_path in image_paths:
+        img = cv2.imread(image_path)
+        if img is None:
+            continue
+        h, w, _ = img.shape
+        for y, _, _ in tile_spans(h, input_size, tile_overlap):
+            for x, _, _ in tile_spans(w, input_size, tile_overlap):
+                tile = img[y:y + input_size, x:x + input_size]
+                # pad with -1 like predict_maps does for pages smaller than a tile
+                batch = np.full((1, input_size, input_size, 3), -1., dtype=np.float32)
+                normalize_image(tile, out=batch[0, :tile.shape[0], :tile.shape[1], :])
+                yield batch
+
+
+def convert(model_path, output_path, quantization, input_size, representative_tiles=None):
+    # writes the tflite model of a frozen graph, representative_tiles is a function returning an iterator over input
+    # batches, required for int8
+    converter = tf.lite.TFLiteConverter.from_frozen_graph(model_path, [INPUT_NAME], [SCORE_MAP_NAME, GEO_MAP_NAME],
+                                                          input_shapes={INPUT_NAME: [1, input_size, input_size, 3]})
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if quantization == 'int8':
+        converter.representative_dataset = tf.lite.RepresentativeDataset(
+            lambda: ([tile] for tile in representative_tiles()))
+    else:
+        converter.target_spec.supported_types = [tf.lite.constants.FLOAT16]
+
+    with open(output_path, 'wb') as f:
+        f.write(converter.convert())
+
+
+def match_boxes(boxes_a, boxes_b, iou_threshold):
+    # one to one matching of two lists of boxes, greedily by decreasing iou as lanms computes it
+    # returns the ious of the matched pairs
+    if len(boxes_a) == 0 or len(boxes_b) == 0:
+        return []
+
+    ious = lanms.iou_matrix(np.array(boxes_a), np.array(boxes_b))
+    matched_a, matched_b, matches = set(), set(), []
+    for i, j in zip(*np.unravel_index(np.argsort(-ious, axis=None), ious.shape)):
+        if ious[i, j] < iou_threshold:
+            break
+        if i in matched_a or j in matched_b:
+            continue
+        matched_a.add(i)
+        matched_b.add(j)
+        matches.append(ious[i, j])
+    return matches
+
+
+def drift_report(float_model, quantized_model, image_paths, input_size, tile_overlap, iou_threshold):
+    # detections of the quantized model compared to the float model on the same tiles, the float boxes are the
+    # reference so recall is the share of float boxes found again and precision the share of quantized boxes that
+    # match a float box
+    nb_float, nb_quantized, ious = 0, 0, []
+    float_time, quantized_time = 0., 0.
+    for image_path in image_paths:
+        img = cv2.imread(image_path)
+        if img is None:
+            continue
+
+        start = time.time()
+        float_boxes = process_image_tiled(float_model, img, input_size, tile_overlap)
+        float_time += time.time() - start
+        start = time.time()
+        quantized_boxes = process_image_tiled(quantized_model, img, input_size, tile_overlap)
+        quantized_time += time.time() - start
+
+        matches = match_boxes(float_boxes, quantized_boxes, iou_threshold)
+        nb_float += len(float_boxes)
+        nb_quantized += len(quantized_boxes)
+        ious.extend(matches)
+        print('{}: {} float boxes, {} quantized boxes, {} matched'.format(image_path, len(float_boxes),
+                                                                          len(quantized_boxes), len(matches)))
+
+    print('Recall: {:.4f}, precision: {:.4f}, mean iou of matched boxes: {:.4f}'.format(
+        len(ious) / max(nb_float, 1), len(ious) / max(nb_quantized, 1), np.mean(ious) if ious else 0.))
+    print('Seconds per image, float: {:.3f}, quantized: {:.3f}'.format(float_time / max(len(image_paths), 1),
+                                                                      quantized_time / max(len(image_paths), 1)))
+
+
+def main():
+    FLAGS = parser.parse_args()
+    logging.getLogger().setLevel(logging.ERROR)
+
+    image_paths = sorted(get_image_paths(FLAGS.calibration_data_path))[:FLAGS.nb_calibration_images]
+    convert(FLAGS.model_path, FLAGS.output_path, FLAGS.quantization, FLAGS.input_size,
+            lambda: calibration_tiles(image_paths, FLAGS.input_size, FLAGS.tile_overlap))
+    print('Wrote {}'.format(FLAGS.output_path))
+
+    drift_report(load_model(FLAGS.model_path), load_model(FLAGS.output_path, backend='tflite'), image_paths,
+                 FLAGS.input_size, FLAGS.tile_overlap, FLAGS.iou_threshold)
+
+
+if __name__ == '__main__':
+    main()
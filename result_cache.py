@@ -0,0 +1,120 @@
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+# first bytes of every cache file, changed when the format or the meaning of the stored boxes changes
+MAGIC = b'EAC1'
+
+
+def bytes_digest(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def file_digest(*paths):
+    # digest of the contents of the files, e.g. the weights and the architecture of a model
+    digest = hashlib.sha256()
+    for path in paths:
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+def result_key(image_digest, model_digest, config):
+    # the boxes of an image depend on its contents, on the weights and on the detection settings in config
+    return bytes_digest(b'\0'.join([MAGIC, image_digest.encode(), model_digest.encode(),
+                                    json.dumps(config, sort_keys=True).encode()]))
+
+
+class ResultCache:
+    # final boxes of images on disk, one file per key holding the boxes as little endian int32, 32 bytes per box
+    # the least recently used files are removed once the files take more than max_bytes
+    # recency survives restarts through the modification time of the files, which get() updates
+    # processes sharing cache_dir each keep their own index, a file removed by another process is a miss
+
+    def __init__(self, cache_dir, max_bytes):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        # key -> size in bytes, least recently used first
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(cache_dir, exist_ok=True)
+        files = []
+        for directory in os.scandir(cache_dir):
+            if not directory.is_dir():
+                continue
+            for entry in os.scandir(directory.path):
+                if entry.name.endswith('.bin'):
+                    stat = entry.stat()
+                    files.append((stat.st_mtime, entry.name[:-4], stat.st_size))
+        for _, key, size in sorted(files):
+            self.entries[key] = size
+            self.total_bytes += size
+        with self.lock:
+            self.evict()
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + '.bin')
+
+    def get(self, key):
+        # boxes stored for key as an array of shape (n, 4, 2), or None
+        with self.lock:
+            if key not in self.entries:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+
+        try:
+            with open(self.path(key), 'rb') as f:
+                data = f.read()
+            os.utime(self.path(key))
+        except FileNotFoundError:
+            data = b''
+        if not data.startswith(MAGIC) or (len(data) - len(MAGIC)) % 32 != 0:
+            with self.lock:
+                self.misses += 1
+                if key in self.entries:
+                    self.total_bytes -= self.entries.pop(key)
+            return None
+
+        with self.lock:
+            self.hits += 1
+        return np.frombuffer(data, dtype='<i4', offset=len(MAGIC)).reshape((-1, 4, 2)).astype(np.int32)
+
+    def put(self, key, boxes):
+        data = MAGIC + np.asarray(boxes, dtype='<i4').reshape((-1, 8)).tobytes()
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # readers never see a partly written file
+        tmp_path = '{}.{}.{}.tmp'.format(path, os.getpid(), threading.get_ident())
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+        with self.lock:
+            self.total_bytes += len(data) - self.entries.get(key, 0)
+            self.entries[key] = len(data)
+            self.entries.move_to_end(key)
+            self.evict()
+
+    def evict(self):
+        # called with the lock held, the most recent entry is kept even when larger than max_bytes
+        while self.total_bytes > self.max_bytes and len(self.entries) > 1:
+            key, size = self.entries.popitem(last=False)
+            self.total_bytes -= size
+            try:
+                os.remove(self.path(key))
+            except FileNotFoundError:
+                pass
+
+    def stats(self):
+        with self.lock:
+            return {'entries': len(self.entries), 'bytes': self.total_bytes, 'hits': self.hits, 'misses': self.misses}
@@ -0,0 +1,73 @@
+import os
+import hashlib
+import argparse
+
+import numpy as np
+
+from data_processor import get_annotation_paths
+
+
+def cache_file(cache_dir, image_path, kind):
+    # samples with the same name in different directories get different files
+    key = hashlib.md5(os.path.abspath(image_path).encode('utf-8')).hexdigest()[:16]
+    name = os.path.splitext(os.path.basename(image_path))[0]
+    return os.path.join(cache_dir, '{}-{}.{}.npz'.format(name, key, kind))
+
+
+def source_mtime(image_path):
+    # latest modification time of the image and its annotation
+    paths = [image_path] + [path for path in get_annotation_paths(image_path) if os.path.exists(path)]
+    return max(os.path.getmtime(path) for path in paths)
+
+
+def load_cached(cache_dir, image_path, kind, params=()):
+    # arrays stored for image_path, None if there is no entry or it is stale
+    # an entry is stale when the image or annotation changed after it was written or it was built with other params
+    try:
+        with np.load(cache_file(cache_dir, image_path, kind)) as data:
+            if data['mtime'] != source_mtime(image_path) or not np.array_equal(data['params'], params):
+                return None
+            return {key: data[key] for key in data.files if key not in ('mtime', 'params')}
+    except (IOError, OSError, KeyError, ValueError):
+        return None
+
+
+def save_cached(cache_dir, image_path, kind, params=(), **arrays):
+    os.makedirs(cache_dir, exist_ok=True)
+    path = cache_file(cache_dir, image_path, kind)
+
+    # several workers can build the same entry, write to a private file and move it in place
+    tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, mtime=source_mtime(image_path), params=np.array(params), **arrays)
+    os.replace(tmp_path, path)
+
+
+def main():
+    from data_generator import DataGenerator
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--data_path', type=str, default='../funsd_parsed/val_data')
+    parser.add_argument('--cache_dir', type=str, default='cache/val_data')
+    parser.add_argument('--input_size', type=int, default=512)
+    parser.add_argument('--is_train', action='store_true')
+
+    parser.add_argument('--min_text_size', type=int, default=10)
+    parser.add_argument('--min_crop_side_ratio', type=float, default=0.1)
+    parser.add_argument('--geometry', type=str, default='RBOX')
+    parser.add_argument('--suppress_warnings_and_error_messages', type=bool, default=True)
+    FLAGS = parser.parse_args()
+
+    # loading every sample once through the generator writes its cache entry
+    generator = DataGenerator(input_size=FLAGS.input_size, batch_size=1, data_path=FLAGS.data_path, FLAGS=FLAGS,
+                              is_train=FLAGS.is_train, cache_dir=FLAGS.cache_dir)
+    for image_path in generator.image_paths:
+        print(image_path)
+        try:
+            generator.load_sample(image_path) if FLAGS.is_train else generator.load_validation(image_path)
+        except Exception as e:
+            print(str(e))
+
+
+if __name__ == '__main__':
+    main()
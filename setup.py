@@ -0,0 +1,20 @@
+# builds the lanms extension ahead of time so that importing lanms does not need to compile it
+# python setup.py build_ext --inplace
+
+from setuptools import setup, Extension
+
+lanms_adaptor = Extension(
+    'lanms.adaptor',
+    sources=['lanms/adaptor.cpp', 'lanms/include/clipper/clipper.cpp'],
+    include_dirs=['lanms', 'lanms/include'],
+    depends=['lanms/lanms.h', 'lanms/include/clipper/clipper.hpp'],
+    extra_compile_args=['-std=c++11', '-O3', '-pthread'],
+    extra_link_args=['-pthread'],
+    language='c++',
+)
+
+setup(
+    name='lanms',
+    packages=['lanms'],
+    ext_modules=[lanms_adaptor],
+)
@@ -0,0 +1,89 @@
+import ctypes
+import collections
+import multiprocessing
+
+import numpy as np
+
+
+class SharedMemoryLoader:
+    # endless batches of a DataGenerator built by worker processes
+    # the workers write their samples straight into a ring of nb_buffers batch buffers in shared memory and the
+    # batches handed out are views into these buffers, nothing is pickled but the image paths
+    # the nb_held most recently handed out batches are never overwritten, it has to be larger than the number of
+    # batches the consumer keeps around, e.g. max_queue_size + 2 for keras' fit_generator
+
+    def __init__(self, generator, nb_workers=8, nb_buffers=16, nb_held=4, seed=None):
+        assert nb_buffers > nb_held
+        self.generator = generator
+        self.nb_buffers = nb_buffers
+        self.nb_held = nb_held
+
+        self.shapes = generator.batch_shapes()
+        batch_floats = generator.batch_size * sum(int(np.prod(shape)) for shape in self.shapes)
+
+        # shared memory has to exist before the workers are forked
+        context = multiprocessing.get_context('fork')
+        self.buffers = [context.RawArray(ctypes.c_float, batch_floats) for _ in range(nb_buffers)]
+        self.tasks = context.Queue()
+        self.done = context.Queue()
+        self.workers = [context.Process(target=self.work, args=(worker_id, seed), daemon=True)
+                        for worker_id in range(nb_workers)]
+        for worker in self.workers:
+            worker.start()
+
+    def views(self, slot):
+        # image, masks, score map and geo map arrays of a batch buffer
+        buffer = np.frombuffer(self.buffers[slot], dtype=np.float32)
+        arrays = []
+        offset = 0
+        for shape in self.shapes:
+            count = self.generator.batch_size * int(np.prod(shape))
+            arrays.append(buffer[offset:offset + count].reshape((self.generator.batch_size,) + shape))
+            offset += count
+        return arrays
+
+    def work(self, worker_id, seed):
+        generator = self.generator
+        generator.seed_process(None if seed is None else seed + worker_id)
+
+        while True:
+            slot, image_paths = self.tasks.get()
+            n = generator.fill_batch(self.views(slot), image_paths)
+            self.done.put((slot, n))
+
+    def batch_paths(self):
+        # image paths of every batch, reshuffled after each pass over the data
+        batch_size = self.generator.batch_size
+        while True:
+            image_paths = list(self.generator.image_paths)
+            np.random.shuffle(image_paths)
+            for start in range(0, len(image_paths), batch_size):
+                yield image_paths[start:start + batch_size]
+
+    def __iter__(self):
+        batch_paths = self.batch_paths()
+        free = collections.deque(range(self.nb_buffers))
+        held = collections.deque()
+
+        while True:
+            # every buffer that is neither held by the consumer nor being filled gets the next batch
+            while len(free) > 0:
+                self.tasks.put((free.popleft(), next(batch_paths)))
+
+            slot, n = self.done.get()
+            if n == 0:
+                free.append(slot)
+                continue
+
+            held.append(slot)
+            if len(held) > self.nb_held:
+                free.append(held.popleft())
+
+            image, overly_small_text_region_training_mask, text_region_boundary_training_mask, score_map, geo_map = \
+                [array[:n] for array in self.views(slot)]
+            yield [image, overly_small_text_region_training_mask, text_region_boundary_training_mask, score_map], \
+                  [score_map, geo_map]
+
+    def close(self):
+        for worker in self.workers:
+            worker.terminate()
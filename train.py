@@ -4,12 +4,13 @@ import argparse
 from datetime import datetime
 
 import keras.backend as K
-from keras.callbacks import TensorBoard, ModelCheckpoint
+from keras.callbacks import Callback, TensorBoard, ModelCheckpoint
 
 from adamw import AdamW
-from losses import dice_loss, rbox_loss
-from model import EastModel
+from losses import training_mask, dice_loss, rbox_loss
+from model import EastModel, set_training_session
 from data_generator import DataGenerator
+from shared_loader import SharedMemoryLoader
 
 parser = argparse.ArgumentParser()
 
@@ -17,20 +18,28 @@ parser.add_argument('--training_data_path', type=str, default='../funsd_parsed/t
 parser.add_argument('--validation_data_path', type=str, default='../funsd_parsed/val_data')
 parser.add_argument('--pretrained_weights_path', type=str, default='models/east/model-icdar2015.h5')
 parser.add_argument('--checkpoint_path', type=str, default='models/east')
+parser.add_argument('--cache_dir', type=str, default='')
 
 parser.add_argument('--input_size', type=int, default=512)
 parser.add_argument('--batch_size', type=int, default=12)
 parser.add_argument('--nb_workers', type=int, default=16)
+parser.add_argument('--shared_memory_loader', action='store_true')
 parser.add_argument('--max_epochs', type=int, default=150)
 parser.add_argument('--init_learning_rate', type=float, default=0.0001)
 parser.add_argument('--save_checkpoint_epochs', type=int, default=10)
+# fast training, xla compiles the training step, mixed_precision runs it in float16 on GPUs with the loss multiplied
+# by a dynamic loss_scale so that small gradients do not underflow
+parser.add_argument('--xla', action='store_true')
+parser.add_argument('--mixed_precision', action='store_true')
+parser.add_argument('--loss_scale', type=float, default=2. ** 15)
 
 parser.add_argument('--min_text_size', type=int, default=10)
 parser.add_argument('--min_crop_side_ratio', type=float, default=0.1)
 parser.add_argument('--geometry', type=str, default='RBOX')
 parser.add_argument('--suppress_warnings_and_error_messages', type=bool, default=True)
 
-FLAGS = parser.parse_args()
+# parsed when train.py runs as a script, so that the benchmarks can import compile_model
+FLAGS = None
 
 
 def tensorboard_callback():
@@ -50,33 +59,76 @@ def checkpoint_callback():
     )
 
 
-def main():
-    train_data_generator = DataGenerator(input_size=FLAGS.input_size, batch_size=FLAGS.batch_size,
-                                         data_path=FLAGS.training_data_path, FLAGS=FLAGS, is_train=True)
-    train_samples_count = len(train_data_generator.image_paths)
-    validation_data_generator = DataGenerator(input_size=FLAGS.input_size, batch_size=FLAGS.batch_size,
-                                              data_path=FLAGS.validation_data_path, FLAGS=FLAGS, is_train=False)
+class ValidationCallback(Callback):
+    # evaluates the model on a Sequence at the end of every epoch with workers of its own and adds the results to the
+    # logs of the callbacks placed after it, as fit_generator does for its validation_data
+    # used with the shared memory loader, whose single thread fit_generator would also use for the validation data
 
-    east = EastModel(FLAGS.input_size)
-    if FLAGS.pretrained_weights_path != '':
-        print(f'Loading pre-trained model at {FLAGS.pretrained_weights_path}')
-        east.model.load_weights(FLAGS.pretrained_weights_path)
+    def __init__(self, generator, workers, use_multiprocessing=True, max_queue_size=10):
+        super().__init__()
+        self.generator = generator
+        self.workers = workers
+        self.use_multiprocessing = use_multiprocessing
+        self.max_queue_size = max_queue_size
+
+    def on_epoch_end(self, epoch, logs=None):
+        outs = self.model.evaluate_generator(self.generator, workers=self.workers,
+                                            use_multiprocessing=self.use_multiprocessing,
+                                            max_queue_size=self.max_queue_size)
+        outs = outs if isinstance(outs, list) else [outs]
+        for name, value in zip(self.model.metrics_names, outs):
+            logs['val_' + name] = value
+        # the progress bar prints the logs before the callbacks run
+        print(' - '.join('val_{}: {:.4f}'.format(name, value) for name, value in zip(self.model.metrics_names, outs)))
 
+
+def compile_model(east, learning_rate, loss_scale=None):
+    # param loss_scale: initial dynamic loss scale of AdamW, for mixed precision training
     score_map_loss_weight = K.variable(0.01, name='score_map_loss_weight')
     small_text_weight = K.variable(0., name='small_text_weight')
+    # shared by both losses
+    mask = training_mask(east.overly_small_text_region_training_mask, east.text_region_boundary_training_mask,
+                         small_text_weight)
 
-    opt = AdamW(FLAGS.init_learning_rate)
+    opt = AdamW(learning_rate, loss_scale=loss_scale)
     east.model.compile(
         loss=[
-            dice_loss(east.overly_small_text_region_training_mask, east.text_region_boundary_training_mask,
-                      score_map_loss_weight, small_text_weight),
-            rbox_loss(east.overly_small_text_region_training_mask, east.text_region_boundary_training_mask,
-                      small_text_weight, east.target_score_map)
+            dice_loss(mask, score_map_loss_weight),
+            rbox_loss(mask, east.target_score_map)
         ],
         loss_weights=[1., 1.],
         optimizer=opt,
     )
 
+
+def main():
+    train_data_generator = DataGenerator(input_size=FLAGS.input_size, batch_size=FLAGS.batch_size,
+                                         data_path=FLAGS.training_data_path, FLAGS=FLAGS, is_train=True,
+                                         cache_dir=FLAGS.cache_dir)
+    train_samples_count = len(train_data_generator.image_paths)
+    validation_data_generator = DataGenerator(input_size=FLAGS.input_size, batch_size=FLAGS.batch_size,
+                                              data_path=FLAGS.validation_data_path, FLAGS=FLAGS, is_train=False,
+                                              cache_dir=FLAGS.cache_dir)
+
+    # workers are forked before tensorflow is initialized
+    if FLAGS.shared_memory_loader:
+        train_loader = SharedMemoryLoader(train_data_generator, nb_workers=FLAGS.nb_workers, nb_held=4)
+        train_batches, workers, use_multiprocessing, max_queue_size = iter(train_loader), 1, False, 2
+        # fit_generator runs its validation_data with the settings above, a single thread, the validation Sequence
+        # keeps its nb_workers processes through its own callback instead
+        validation_data, validation_callbacks = None, [ValidationCallback(validation_data_generator, FLAGS.nb_workers)]
+    else:
+        train_batches, workers, use_multiprocessing, max_queue_size = train_data_generator, FLAGS.nb_workers, True, 10
+        validation_data, validation_callbacks = validation_data_generator, []
+
+    set_training_session(xla=FLAGS.xla, mixed_precision=FLAGS.mixed_precision)
+    east = EastModel(FLAGS.input_size)
+    if FLAGS.pretrained_weights_path != '':
+        print(f'Loading pre-trained model at {FLAGS.pretrained_weights_path}')
+        east.model.load_weights(FLAGS.pretrained_weights_path)
+
+    compile_model(east, FLAGS.init_learning_rate, loss_scale=FLAGS.loss_scale if FLAGS.mixed_precision else None)
+
     tb_callback = tensorboard_callback()
     cp_callback = checkpoint_callback()
 
@@ -84,21 +136,23 @@ def main():
         json_file.write(east.model.to_json())
 
     east.model.fit_generator(
-        generator=train_data_generator,
+        generator=train_batches,
         epochs=FLAGS.max_epochs,
         steps_per_epoch=train_samples_count // FLAGS.batch_size,
-        validation_data=validation_data_generator,
+        validation_data=validation_data,
 
-        callbacks=[cp_callback, tb_callback],
+        # the validation callback adds val_loss before the checkpoint reads it
+        callbacks=validation_callbacks + [cp_callback, tb_callback],
 
-        workers=FLAGS.nb_workers,
-        use_multiprocessing=True,
-        max_queue_size=10,
+        workers=workers,
+        use_multiprocessing=use_multiprocessing,
+        max_queue_size=max_queue_size,
 
         verbose=1,
     )
 
 
 if __name__ == '__main__':
+    FLAGS = parser.parse_args()
     logging.getLogger().setLevel(logging.ERROR)
     main()